@@ -0,0 +1,8 @@
+"""
+benchmarks
+~~~~~~~~~~
+
+Timing scripts for figure_portfolio. Run them from the top directory, e.g.
+`python -m benchmarks.bench_batch`.  `python -m benchmarks.suite` times the 
+main operations from 1k to 500k tiddlers and saves the results as JSON.
+"""
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+bench_batch.py
+~~~~~~~~~~~~~~
+
+Compare N sequential `addtiddler()` calls against one `addtiddlers()` batch.
+
+    python -m benchmarks.bench_batch [N] [template.html]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+
+def specs(n):
+    return [dict(title='Run {:05d}'.format(i),
+                 image='run{:05d}/temp.png'.format(i),
+                 description='parameter sweep step {}'.format(i),
+                 tags='sweep, step {}'.format(i % 10))
+            for i in range(n)]
+
+def bench(n, template):
+    workd = tempfile.mkdtemp()
+    try:
+        seq = os.path.join(workd, 'sequential.html')
+        bat = os.path.join(workd, 'batch.html')
+        shutil.copy(template, seq)
+        shutil.copy(template, bat)
+        tiddlers = specs(n)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            for spec in tiddlers:
+                figure_portfolio.addtiddler(seq, **spec)
+            t1 = time.perf_counter()
+            figure_portfolio.addtiddlers(bat, tiddlers)
+            t2 = time.perf_counter()
+
+        print('{} tiddlers, template {} ({} bytes)'.format(n, template, 
+            os.path.getsize(template)))
+        print('  sequential addtiddler(): {:8.3f} s'.format(t1 - t0))
+        print('  batch addtiddlers():     {:8.3f} s'.format(t2 - t1))
+        print('  speedup:                 {:8.1f} x'.format((t1 - t0) / (t2 - t1)))
+    finally:
+        shutil.rmtree(workd)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    template = sys.argv[2] if len(sys.argv) > 2 else os.path.join('tests', 'tw5md_mock.html')
+    bench(n, template)
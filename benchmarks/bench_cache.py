@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+bench_cache.py
+~~~~~~~~~~~~~~
+
+Startup time of `TiddlyWikiParse.read()` on a large wiki: full text read, 
+memory-mapped scan, and memory-mapped with the sidecar index `.fpidx`.
+
+    python -m benchmarks.bench_cache [ntiddlers] [body_size]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def timed_read(path, **kwargs):
+    t0 = time.perf_counter()
+    tw = figure_portfolio.TiddlyWikiParse(path, **kwargs)
+    tw.read()
+    t1 = time.perf_counter()
+    tw.close()
+    return t1 - t0
+
+def bench(ntiddlers=100000, body_size=1000):
+    workd = tempfile.mkdtemp()
+    path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), ntiddlers, body_size)
+    try:
+        print('{} tiddlers, {:.1f} MB'.format(ntiddlers, os.path.getsize(path) / 2**20))
+        print('  read():                    {:7.3f} s'.format(timed_read(path)))
+        print('  read(), lazy:              {:7.3f} s'.format(timed_read(path, lazy=True)))
+        print('  read(), index written:     {:7.3f} s'.format(timed_read(path, cache=True)))
+        print('  read(), index loaded:      {:7.3f} s'.format(timed_read(path, cache=True)))
+        print('  index file {:.1f} MB'.format(os.path.getsize(path + '.fpidx') / 2**20))
+    finally:
+        for f in (path, path + '.fpidx'):
+            os.remove(f)
+        os.rmdir(workd)
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+bench_catalog.py
+~~~~~~~~~~~~~~~~
+
+"Which runs have tag X in date range Y": a query of the SQLite `Catalog`
+against reading the wiki and looping over its tiddlers.
+
+    python -m benchmarks.bench_catalog
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def loop_query(wiki, tag, since, until):
+    tw = figure_portfolio.TiddlyWikiParse(wiki)
+    tw.read()
+    return [td.title for td in tw.tiddlers
+        if tag in getattr(td, 'tags', ()) and since <= td.created < until]
+
+def bench(sizes=(10000, 100000, 300000), queries=20):
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format('tiddlers', 'read+loop',
+        'first sync', 'no-op sync', 'query'))
+    workd = tempfile.mkdtemp()
+    try:
+        for n in sizes:
+            wiki = synthwiki.make_wiki(os.path.join(workd, 'w.html'), n)
+            t0 = time.perf_counter()
+            expected = loop_query(wiki, '[[param 7]]', '201803', '201806')
+            t1 = time.perf_counter()
+            with figure_portfolio.Catalog(wiki) as cat:
+                cat.sync()
+                t2 = time.perf_counter()
+                cat.sync()
+                t3 = time.perf_counter()
+                for i in range(queries):
+                    found = cat.query(tags=['param 7'], since='201803', until='201806')
+                t4 = time.perf_counter()
+            assert sorted(t for t, im in found) == sorted(expected)
+            print('{:>8} {:>10.3f}s {:>10.3f}s {:>10.1f}ms {:>10.2f}ms'.format(n,
+                t1 - t0, t2 - t1, (t3 - t2) * 1e3, (t4 - t3) / queries * 1e3))
+            os.remove(wiki)
+            os.remove(wiki + '.fpdb')
+    finally:
+        shutil.rmtree(workd)
+
+if __name__ == '__main__':
+    bench()
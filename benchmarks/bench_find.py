@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+bench_find.py
+~~~~~~~~~~~~~
+
+Scaling of `find_tiddler()` and of `new_tiddler(replace=False)` with the 
+number of tiddlers, against the linear scan used before the title index.
+
+    python -m benchmarks.bench_find
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def linear_find(tw, title):
+    for i, td in enumerate(tw.tiddlers):
+        if title == td.title:
+            return i, td.created
+    return None, None
+
+def linear_free_title(tw, title):
+    for i in range(1, 100):
+        tlnext = title + '-{0:02d}'.format(i)
+        if linear_find(tw, tlnext)[0] is None:
+            return tlnext
+    return None
+
+def bench(sizes=(100, 1000, 10000, 100000), lookups=200):
+    print('{:>8} {:>14} {:>14} {:>14} {:>14}'.format('tiddlers', 
+        'linear find', 'index find', 'linear rename', 'index rename'))
+    workd = tempfile.mkdtemp()
+    for n in sizes:
+        path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), n)
+        tw = figure_portfolio.TiddlyWikiParse(path)
+        tw.read()
+        # 'Run 000000' already has the suffixes -01 ... -49
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(49):
+                tw.new_tiddler('Run 000000', 'text', [], replace=False)
+        titles = ['Run {:06d}'.format(n - 1 - i % n) for i in range(lookups)]
+
+        t0 = time.perf_counter()
+        for t in titles:
+            linear_find(tw, t)
+        t1 = time.perf_counter()
+        for t in titles:
+            tw.find_tiddler(t)
+        t2 = time.perf_counter()
+        for i in range(10):
+            linear_free_title(tw, 'Run 000000')
+        t3 = time.perf_counter()
+        for i in range(10):
+            tw.suffixhint.clear()
+            tw.free_title('Run 000000')
+        t4 = time.perf_counter()
+        print('{:>8} {:>12.2f}us {:>12.2f}us {:>12.2f}ms {:>12.2f}ms'.format(n, 
+            (t1 - t0) / lookups * 1e6, (t2 - t1) / lookups * 1e6, 
+            (t3 - t2) / 10 * 1e3, (t4 - t3) / 10 * 1e3))
+        os.remove(path)
+    os.rmdir(workd)
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+bench_lazy.py
+~~~~~~~~~~~~~
+
+Peak Python memory and time of reading and publishing a large wiki, with the 
+tiddler text in memory against the memory-mapped (`lazy=True`) mode.
+
+    python -m benchmarks.bench_lazy [ntiddlers] [body_size]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def run(path, outfile, lazy):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    tw = figure_portfolio.TiddlyWikiParse(path, lazy=lazy)
+    tw.read()
+    tw.new_tiddler('Run 000000', 'changed', ['sweep'], replace=True)
+    tw.publish(outfile)
+    tw.close()
+    t1 = time.perf_counter()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return t1 - t0, peak
+
+def bench(ntiddlers=20000, body_size=5000):
+    workd = tempfile.mkdtemp()
+    path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), ntiddlers, body_size)
+    outfile = os.path.join(workd, 'out.html')
+    try:
+        print('{} tiddlers, {:.1f} MB'.format(ntiddlers, os.path.getsize(path) / 2**20))
+        for lazy in (False, True):
+            elapsed, peak = run(path, outfile, lazy)
+            print('  lazy={!s:5}  read+publish {:7.3f} s   peak {:8.1f} MB'.format(
+                lazy, elapsed, peak / 2**20))
+    finally:
+        for f in (path, outfile):
+            os.remove(f)
+        os.rmdir(workd)
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+bench_lock.py
+~~~~~~~~~~~~~
+
+Several processes adding tiddlers to the same wiki: plain `addtiddler()` 
+against `addtiddler(lock=True)`. Reports inserts/sec and the tiddlers lost.
+
+    python -m benchmarks.bench_lock [nworkers] [per_worker] [template.html]
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+
+def worker(wiki, w, n, lock):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(n):
+            figure_portfolio.addtiddler(wiki, 'Worker {} run {}'.format(w, i), 
+                description='run', tags='sweep', lock=lock)
+
+def run(template, nworkers, per_worker, lock):
+    workd = tempfile.mkdtemp()
+    try:
+        wiki = os.path.join(workd, 'w.html')
+        shutil.copy(template, wiki)
+        procs = [multiprocessing.Process(target=worker, 
+            args=(wiki, w, per_worker, lock)) for w in range(nworkers)]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        found = sum(1 for td in tw.tiddlers if td.title.startswith('Worker '))
+        return elapsed, found
+    finally:
+        shutil.rmtree(workd)
+
+def bench(nworkers=8, per_worker=50, template=os.path.join('tests', 'tw5md_mock.html')):
+    total = nworkers * per_worker
+    print('{} workers x {} tiddlers'.format(nworkers, per_worker))
+    for lock in (False, True):
+        elapsed, found = run(template, nworkers, per_worker, lock)
+        print('  lock={!s:5}  {:8.1f} inserts/s   lost {}'.format(lock, 
+            total / elapsed, total - found))
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    bench(*[int(a) for a in args[:2]], *args[2:])
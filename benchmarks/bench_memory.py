@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+bench_memory.py
+~~~~~~~~~~~~~~~
+
+Memory held by the tiddlers of a large wiki, measured with tracemalloc: the
+`__slots__` `Tiddler` against the previous class, copied below, which kept
+a `__dict__`, a list of lines and a `taglist` per tiddler.
+
+    python -m benchmarks.bench_memory
+"""
+
+import html
+import mmap
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+class OldTiddler(object):
+    """`Tiddler` before `__slots__`. """
+    def __init__(self, text, source=None):
+        """Constructor
+
+        :param list text: List of the text lines for the tiddler object.
+         `None` when the text is kept in `source`.
+        :param tuple source: `(mapping, start, end)`, the byte range of the 
+         tiddler in a memory-mapped wiki. The text is decoded on demand.
+        """
+        self._text = text
+        self.source = source
+        self.taglist = []
+
+    @property
+    def text(self):
+        """List of the text lines. Decoded from `source` at every access 
+        for the memory-mapped tiddlers."""
+        if self._text is None:
+            mapping, start, end = self.source
+            return figure_portfolio.splitlines(mapping[start:end].decode('utf-8'))
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self.source = None
+
+    def head(self):
+        """The first line of the tiddler. """
+        if self._text is None:
+            mapping, start, end = self.source
+            eol = mapping.find(b'\n', start, end)
+            return mapping[start:eol + 1].decode('utf-8')
+        return self._text[0]
+
+    def raw(self):
+        """The tiddler as utf-8 bytes. The memory-mapped range is copied as 
+        it is. """
+        if self._text is None:
+            mapping, start, end = self.source
+            return mapping[start:end]
+        return ''.join(self._text).encode('utf-8')
+
+    def block(self):
+        """The tiddler in one piece: bytes of the memory-mapped range, or the 
+        joined text, which `TiddlyWikiParse.publish()` encodes together with 
+        the neighbouring tiddlers. """
+        if self._text is None:
+            return self.raw()
+        return ''.join(self._text)
+        
+    def parse(self, fast=True):
+        """Parse the Tiddler contents. 
+
+        Only the attributes of the opening div element are needed, so they 
+        are taken out of the first line with `figure_portfolio.regdivattr`, and the body is 
+        not parsed. `MyHTMLParser` is used when `fast` is `False` or the 
+        first line is not a complete div tag.
+        """
+        head = self.head()
+        end = head.find('>')
+        if fast and head.startswith('<div ') and end > 0:
+            divattrs = {name.lower(): html.unescape(value) 
+                for name, value in figure_portfolio.regdivattr.findall(head, 0, end)}
+        else:
+            divattrs = self.parse_html()
+        self.title = divattrs.get('title')
+        self.created = divattrs.get('created')
+        self.modified = divattrs.get('modified')
+        if not self.title.startswith(r'$:/'):
+            divtags = divattrs.get('tags')
+            if divtags:
+                self.tags = figure_portfolio.regtag.findall(divtags)
+        
+    def parse_html(self):
+        """Attributes of the div element, with `MyHTMLParser`. The lines are 
+        fed up to the end of the opening tag.
+        """
+        parser = figure_portfolio.MyHTMLParser()
+        for line in self.text:
+            parser.feed(line)
+            if hasattr(parser, 'divattrs'):
+                break
+        return parser.divattrs
+
+    def __repr__(self):
+        return self.title + ": " + ''.join(self.text)[:40]
+
+
+def tiddler_lines(path):
+    """The lines of each tiddler of `path`, as `read_tiddler()` splits them. """
+    tw = figure_portfolio.TiddlyWikiParse(path, lazy=True)
+    tw.read()
+    with open(path, encoding='utf-8') as fp:
+        text = fp.read()
+    start = len(''.join(tw.headerlines))
+    end = len(text) - len(''.join(tw.trailerlines))
+    lines = figure_portfolio.splitlines(text[start:end])
+    tw.close()
+    tiddler = []
+    for line in lines:
+        tiddler.append(line)
+        if line.endswith('</div>\n'):
+            yield tiddler
+            tiddler = []
+
+def measure(build):
+    tracemalloc.start()
+    tiddlers = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(tiddlers), current
+
+def bench(n=200000):
+    workd = tempfile.mkdtemp()
+    try:
+        path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), n)
+        tw = figure_portfolio.TiddlyWikiParse(path, lazy=True)
+        tw.read()
+        ranges = list(tw.ranges)
+        tw.close()
+        with open(path, 'rb') as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            print('{} tiddlers'.format(n))
+            print('{:>10} {:>12} {:>12}'.format('mode', 'class', 'memory'))
+            for name, cls in [('previous', OldTiddler), ('slots', figure_portfolio.Tiddler)]:
+                def build_text():
+                    tiddlers = []
+                    for lines in tiddler_lines(path):
+                        td = cls(lines)
+                        td.parse()
+                        tiddlers.append(td)
+                    return tiddlers
+                def build_mapped():
+                    tiddlers = []
+                    for start, end in ranges:
+                        td = cls(None, (mm, start, end))
+                        td.parse()
+                        tiddlers.append(td)
+                    return tiddlers
+                for mode, build in [('text', build_text), ('mapped', build_mapped)]:
+                    count, memory = measure(build)
+                    print('{:>10} {:>12} {:>10.1f}MB'.format(mode, name, memory / 2**20))
+            mm.close()
+    finally:
+        shutil.rmtree(workd)
+
+if __name__ == '__main__':
+    bench()
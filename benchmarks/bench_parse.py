@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+bench_parse.py
+~~~~~~~~~~~~~~
+
+Load time of a ~50 MB wiki, parsing the tiddler headers with `regdivattr` 
+against running `MyHTMLParser` over each tiddler.
+
+    python -m benchmarks.bench_parse [ntiddlers]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def full_text_parse(td):
+    """The parse before the header regex: the whole tiddler went through 
+    the HTML parser. """
+    parser = figure_portfolio.MyHTMLParser()
+    parser.feed(''.join(td.text))
+    return parser.divattrs
+
+def bench(ntiddlers=20000):
+    workd = tempfile.mkdtemp()
+    path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), ntiddlers, 
+        body_size=2000, plugin_size=10 * 2**20)
+    try:
+        t0 = time.perf_counter()
+        tw = figure_portfolio.TiddlyWikiParse(path)
+        tw.read()
+        t1 = time.perf_counter()
+        for td in tw.tiddlers:
+            td.parse()
+        t2 = time.perf_counter()
+        for td in tw.tiddlers:
+            td.parse(fast=False)
+        t3 = time.perf_counter()
+        for td in tw.tiddlers:
+            full_text_parse(td)
+        t4 = time.perf_counter()
+        print('{} tiddlers, {:.1f} MB'.format(len(tw.tiddlers), 
+            os.path.getsize(path) / 2**20))
+        print('  read():                   {:8.3f} s'.format(t1 - t0))
+        print('  parse(), header regex:    {:8.3f} s'.format(t2 - t1))
+        print('  parse(fast=False):        {:8.3f} s'.format(t3 - t2))
+        print('  HTMLParser on whole text: {:8.3f} s'.format(t4 - t3))
+    finally:
+        os.remove(path)
+        os.rmdir(workd)
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+bench_paths.py
+~~~~~~~~~~~~~~
+
+Relative image paths for a large glob: one `PathResolver` for the whole
+list against a call of the per-image algorithm used before for each image.
+
+    python -m benchmarks.bench_paths
+"""
+
+import ntpath
+import posixpath
+import time
+
+from figure_portfolio import figure_portfolio
+
+def per_image(outfile, impath, flavor):
+    # normalizes and splits the output path again for every image
+    opath_ele = flavor.normpath(outfile).split(flavor.sep)
+    im_ele = flavor.normpath(impath).split(flavor.sep)
+    olen, ilen = len(opath_ele), len(im_ele)
+    for i in range(min(olen, ilen)):
+        if im_ele[i] != opath_ele[i]:
+            break
+    return flavor.normpath(flavor.join(*([flavor.pardir] * (olen - 1 - i)
+        + im_ele[i:])))
+
+def bench(n=100000, ndirs=(1, 100, 10000)):
+    print('{:>8} {:>6} {:>12} {:>12} {:>12}'.format('flavor', 'dirs',
+        'per image', 'resolver', 'speedup'))
+    for flavor, outfile, root in [(posixpath, 'site/wiki/tw.html', 'runs'),
+        (ntpath, 'site\\wiki\\tw.html', 'runs')]:
+        for nd in ndirs:
+            images = [flavor.join(root, 'r{:05d}'.format(i % nd),
+                'fig{:06d}.png'.format(i)) for i in range(n)]
+            t0 = time.perf_counter()
+            [per_image(outfile, im, flavor) for im in images]
+            t1 = time.perf_counter()
+            figure_portfolio.relative_path_to_image(outfile, images, flavor)
+            t2 = time.perf_counter()
+            print('{:>8} {:>6} {:>10.3f}s {:>10.3f}s {:>11.1f}x'.format(
+                flavor.__name__, nd, t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1)))
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+bench_publish.py
+~~~~~~~~~~~~~~~~
+
+Write throughput of `TiddlyWikiParse.publish()` on a synthetic wiki, against 
+the former line-by-line text writer, for several buffer sizes.
+
+    python -m benchmarks.bench_publish [ntiddlers]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def line_publish(tw, outfile):
+    """`publish()` before the bulk writer: one write per line. """
+    with open(outfile, encoding='utf-8', mode='w') as twout:
+        for head_l in tw.headerlines:
+            twout.write(head_l)
+        for tid in tw.tiddlers:
+            for tid_l in tid.text:
+                twout.write(tid_l)
+        for trail_l in tw.trailerlines:
+            twout.write(trail_l)
+
+def timed(func, *args, **kwargs):
+    """Best of three runs. """
+    best = None
+    for i in range(3):
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+def bench(ntiddlers=100000):
+    workd = tempfile.mkdtemp()
+    path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), ntiddlers)
+    outfile = os.path.join(workd, 'out.html')
+    mb = os.path.getsize(path) / 2**20
+    try:
+        print('{} tiddlers, {:.1f} MB'.format(ntiddlers, mb))
+        tw = figure_portfolio.TiddlyWikiParse(path)
+        tw.read()
+        print('  {:34} {:8.1f} MB/s'.format('line by line', 
+            mb / timed(line_publish, tw, outfile)))
+        for bufsize in (2**13, 2**16, 2**20, 2**23):
+            print('  {:34} {:8.1f} MB/s'.format('publish(bufsize={})'.format(bufsize), 
+                mb / timed(tw.publish, outfile, bufsize=bufsize)))
+        print('  {:34} {:8.1f} MB/s'.format('publish(fsync=True)', 
+            mb / timed(tw.publish, outfile, fsync=True)))
+        twl = figure_portfolio.TiddlyWikiParse(path, lazy=True)
+        twl.read()
+        print('  {:34} {:8.1f} MB/s'.format('lazy publish (pass-through)', 
+            mb / timed(twl.publish, outfile)))
+        twl.close()
+    finally:
+        for f in (path, outfile):
+            os.remove(f)
+        os.rmdir(workd)
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+bench_query.py
+~~~~~~~~~~~~~~
+
+`TiddlyWikiParse.query()` against a scan of every tiddler, as the report
+scripts did: the tags are parsed again with `regtag` for each tiddler.
+
+    python -m benchmarks.bench_query
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+def scan(tw, tags, not_tags, since, until, title):
+    found = []
+    for td in tw.tiddlers:
+        head = td.head()
+        m = re.search(r' tags="([^"]*)"', head)
+        tdtags = figure_portfolio.regtag.findall(m.group(1)) if m else []
+        if all(t in tdtags for t in tags) and not any(t in tdtags for t in not_tags) \
+            and since <= td.created < until and td.title.startswith(title):
+            found.append(td)
+    return found
+
+QUERIES = [
+    ('one tag', dict(tags=['[[param 7]]']), dict(tags=['param 7'])),
+    ('tag and date', dict(tags=['[[param 7]]'], since='201803', until='201806'),
+        dict(tags=['param 7'], created=('201803', '201806'))),
+    ('tag, not tag', dict(tags=['sweep'], not_tags=['[[param 7]]']),
+        dict(tags=['sweep'], not_tags=['param 7'])),
+    ('title prefix', dict(title='Run 0001'), dict(title='Run 0001')),
+]
+
+def bench(sizes=(10000, 100000), repeat=5):
+    workd = tempfile.mkdtemp()
+    try:
+        for n in sizes:
+            wiki = synthwiki.make_wiki(os.path.join(workd, 'w.html'), n)
+            tw = figure_portfolio.TiddlyWikiParse(wiki)
+            tw.read()
+            t0 = time.perf_counter()
+            tw.query_index()
+            t1 = time.perf_counter()
+            print('{} tiddlers, index built in {:.1f}ms'.format(n, (t1 - t0) * 1e3))
+            print('{:>16} {:>8} {:>12} {:>12}'.format('query', 'found', 'scan', 'query()'))
+            for name, brute, args in QUERIES:
+                kw = dict(tags=[], not_tags=[], since='', until='9', title='')
+                kw.update(brute)
+                t0 = time.perf_counter()
+                for i in range(repeat):
+                    expected = scan(tw, **kw)
+                t1 = time.perf_counter()
+                for i in range(repeat):
+                    found = tw.query(**args)
+                t2 = time.perf_counter()
+                assert found == expected
+                print('{:>16} {:>8} {:>10.2f}ms {:>10.2f}ms'.format(name, len(found),
+                    (t1 - t0) / repeat * 1e3, (t2 - t1) / repeat * 1e3))
+            os.remove(wiki)
+    finally:
+        shutil.rmtree(workd)
+
+if __name__ == '__main__':
+    bench()
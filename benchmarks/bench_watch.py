@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+bench_watch.py
+~~~~~~~~~~~~~~
+
+Cost of a `DirectoryWatcher.poll()` on a tree of 100k images, when nothing
+changed and when a new image lands in one directory, against a full rescan.
+
+    python -m benchmarks.bench_watch
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+
+def make_tree(root, ndirs, nfiles):
+    for d in range(ndirs):
+        path = os.path.join(root, 'run{:04d}'.format(d))
+        os.makedirs(path)
+        for f in range(nfiles // ndirs):
+            open(os.path.join(path, 'temp_{}.png'.format(f)), 'wb').close()
+
+def bench(ndirs=1000, nfiles=100000, polls=10):
+    workd = tempfile.mkdtemp()
+    try:
+        make_tree(workd, ndirs, nfiles)
+        # the directories just written are listed at every poll until then
+        time.sleep(figure_portfolio.DirectoryWatcher.racy)
+        t0 = time.perf_counter()
+        watcher = figure_portfolio.DirectoryWatcher(workd)
+        t1 = time.perf_counter()
+        for i in range(polls):
+            watcher.poll()
+        t2 = time.perf_counter()
+        tnew = 0.0
+        for i in range(polls):
+            # a new image in one directory; sleep so that its mtime changes
+            time.sleep(0.01)
+            open(os.path.join(workd, 'run0000', 'new_{}.png'.format(i)), 'wb').close()
+            t = time.perf_counter()
+            assert len(watcher.poll()) == 1
+            tnew += time.perf_counter() - t
+        t3 = time.perf_counter()
+        for i in range(polls):
+            figure_portfolio.scan_images(workd)
+        t4 = time.perf_counter()
+        print('{} images in {} directories'.format(len(watcher.images), ndirs))
+        print('{:>24} {:>10.1f}ms'.format('initial scan', (t1 - t0) * 1e3))
+        print('{:>24} {:>10.1f}ms'.format('poll, no change', (t2 - t1) / polls * 1e3))
+        print('{:>24} {:>10.1f}ms'.format('poll, one new image', tnew / polls * 1e3))
+        print('{:>24} {:>10.1f}ms'.format('full rescan', (t4 - t3) / polls * 1e3))
+    finally:
+        shutil.rmtree(workd)
+
+if __name__ == '__main__':
+    bench()
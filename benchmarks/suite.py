@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+suite.py
+~~~~~~~~
+
+Time the main operations of `TiddlyWikiParse` on synthetic wikis of several
+sizes and save the results as JSON, so that two commits can be compared.
+
+    python -m benchmarks.suite -o before.json
+    python -m benchmarks.suite -o after.json --compare before.json
+
+Each operation is repeated and the best time is kept.  With `--compare`, an
+operation slower than in the older results by more than `--threshold` is
+reported as a regression and the exit status is 1.
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from figure_portfolio import figure_portfolio
+from benchmarks import synthwiki
+
+SIZES = (1000, 10000, 100000, 500000)
+
+def best(func, repeat):
+    """Best wall time of `repeat` calls of `func(i)`. """
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def read(wiki, **kw):
+    tw = figure_portfolio.TiddlyWikiParse(wiki, **kw)
+    tw.read()
+    tw.close()
+    return tw
+
+def specs(n, batch):
+    return [dict(title='Bench {} {:05d}'.format(n, i),
+        image='bench{:05d}/temp.png'.format(i),
+        description='benchmark step {}'.format(i), tags='bench')
+        for i in range(batch)]
+
+def bench_size(workd, n, repeat, finds=1000, batch=1000, **wiki):
+    """Times of the operations on a wiki of `n` tiddlers. """
+    path = synthwiki.make_wiki(os.path.join(workd, 'w.html'), n, **wiki)
+    outfile = os.path.join(workd, 'out.html')
+    results = dict(bytes=os.path.getsize(path))
+    results['read'] = best(lambda i: read(path), repeat)
+    results['read_lazy'] = best(lambda i: read(path, lazy=True), repeat)
+    read(path, cache=True)  # writes the sidecar index
+    results['read_cached'] = best(lambda i: read(path, cache=True), repeat)
+
+    tw = read(path)
+    titles = ['Run {:06d}'.format(i * n // finds) for i in range(finds)]
+    results['find'] = best(lambda i: [tw.find_tiddler(t) for t in titles],
+        repeat) / finds
+    results['tags'] = best(lambda i: tw.tags(), repeat)
+    results['taglist_tiddler'] = best(lambda i: tw.taglist_tiddler(), repeat)
+    results['publish'] = best(lambda i: tw.publish(outfile), repeat)
+    del tw
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # appended in place, then with a rewrite of the whole wiki
+        results['add'] = best(lambda i: figure_portfolio.addtiddler(path,
+            'Bench add {}'.format(i), description='added'), repeat)
+        results['add_replace'] = best(lambda i: figure_portfolio.addtiddler(path,
+            'Run 000000', description='replaced {}'.format(i)), repeat)
+        figure_portfolio.addtiddler(path, 'Bench cached', description='added', 
+            cache=True)     # writes the sidecar index
+        results['add_cached'] = best(lambda i: figure_portfolio.addtiddler(path,
+            'Bench cached {}'.format(i), description='added', cache=True), repeat)
+        results['batch_add'] = best(lambda i: figure_portfolio.addtiddlers(path,
+            specs(i, batch)), repeat)
+    for name in os.listdir(workd):
+        os.remove(os.path.join(workd, name))
+    return results
+
+def metadata(options):
+    """Where and how the results were taken. """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(commit=commit, date=datetime.datetime.now().isoformat(),
+        python=platform.python_version(), platform=platform.platform(),
+        repeat=options.repeat, body_size=options.body_size, ntags=options.ntags,
+        tags_per_tiddler=options.tags_per_tiddler, plugin_size=options.plugin_size,
+        nplugins=options.nplugins)
+
+def compare(old, new, threshold):
+    """Print the ratios of the times in `new` to the ones in `old`.
+
+    :return: Number of the operations slower by more than `threshold`.
+    """
+    regressions = 0
+    print('{:>8} {:>16} {:>12} {:>12} {:>8}'.format('tiddlers', 'operation',
+        'old', 'new', 'ratio'))
+    for n, results in new['results'].items():
+        for op, t in results.items():
+            t0 = old['results'].get(n, {}).get(op)
+            if op == 'bytes' or not t0:
+                continue
+            flag = ''
+            if t / t0 > threshold:
+                flag = ' slower'
+                regressions += 1
+            print('{:>8} {:>16} {:>11.3g}s {:>11.3g}s {:>7.2f}x{}'.format(n, op,
+                t0, t, t / t0, flag))
+    return regressions
+
+def main():
+    parser = optparse.OptionParser(usage='python -m benchmarks.suite [options]')
+    parser.add_option('--sizes', default=','.join(str(n) for n in SIZES),
+        help='Comma-separated numbers of tiddlers. Default %default.')
+    parser.add_option('--repeat', type='int', default=3,
+        help='Runs of each operation; the best is kept. Default %default.')
+    parser.add_option('--body-size', type='int', default=200, dest='body_size',
+        help='Size of the tiddler bodies in bytes. Default %default.')
+    parser.add_option('--ntags', type='int', default=50,
+        help='Number of distinct tags. Default %default.')
+    parser.add_option('--tags-per-tiddler', type='int', default=1,
+        dest='tags_per_tiddler', help='Tags of each tiddler. Default %default.')
+    parser.add_option('--plugin-size', type='int', default=0, dest='plugin_size',
+        help='Size of each embedded plugin-like tiddler in bytes. Default %default.')
+    parser.add_option('--nplugins', type='int', default=1,
+        help='Number of plugin-like tiddlers. Default %default.')
+    parser.add_option('-o', dest='output', default='bench_results.json',
+        help='JSON file of the results. Default %default.')
+    parser.add_option('--compare',
+        help='Older JSON results to compare with.')
+    parser.add_option('--threshold', type='float', default=1.2,
+        help='Ratio above which an operation is reported as slower. Default %default.')
+    (options, args) = parser.parse_args()
+
+    record = dict(metadata(options), results={})
+    workd = tempfile.mkdtemp()
+    try:
+        for n in [int(s) for s in options.sizes.split(',')]:
+            results = bench_size(workd, n, options.repeat,
+                body_size=options.body_size, ntags=options.ntags,
+                tags_per_tiddler=options.tags_per_tiddler,
+                plugin_size=options.plugin_size, nplugins=options.nplugins)
+            record['results'][str(n)] = results
+            print('{} tiddlers, {} bytes'.format(n, results['bytes']))
+            for op, t in results.items():
+                if op != 'bytes':
+                    print('{:>24} {:>12.3g}s'.format(op, t))
+    finally:
+        shutil.rmtree(workd)
+    with open(options.output, encoding='utf-8', mode='w') as fp:
+        json.dump(record, fp, indent=1)
+    print('saved: ', options.output)
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as fp:
+            old = json.load(fp)
+        if compare(old, record, options.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+synthwiki.py
+~~~~~~~~~~~~
+
+Generate synthetic TiddlyWiki files for the benchmarks.  The header and the 
+trailer are taken from a template wiki, and `ntiddlers` markdown tiddlers are 
+written in between in the same format as `TiddlyWikiParse.tiddler_generate()`.
+"""
+
+import html
+import os
+
+from figure_portfolio import figure_portfolio
+
+TEMPLATE = os.path.join('tests', 'tw5md_mock.html')
+
+def tiddler_block(i, body_size=200, ntags=50, tags_per_tiddler=1):
+    """Text of the `i` th synthetic tiddler. It is tagged `sweep` and 
+    `tags_per_tiddler` distinct `[[param k]]` out of `ntags`. """
+    created = '2018{:02d}{:02d}{:09d}'.format(i % 12 + 1, i % 28 + 1, i)
+    tags = ''
+    if ntags:
+        tags = ' '.join(['sweep'] + ['[[param {}]]'.format((i * tags_per_tiddler + k) 
+            % ntags) for k in range(min(tags_per_tiddler, ntags))])
+    body = '![image](run{0:06d}/temp.png){{:width="1000"}}\n'.format(i)
+    body += ('x' * 79 + '\n') * (body_size // 80)
+    return ('<div created="{c}" modified="{c}" tags="{t}" title="Run {i:06d}" '
+        'type="text/x-markdown">\n<pre>{b}\n</pre></div>\n').format(
+        c=created, t=tags, i=i, b=html.escape(body))
+
+def plugin_block(size, n=0):
+    """The `n` th plugin-like system tiddler holding `size` bytes of 
+    base64-ish text. """
+    line = 'QUJDREVGR0hJSktMTU5PUFFSU1RVVldYWVphYmNkZWZnaGlqa2xtbm9wcXJzdHV2d3h5'
+    body = (line + '\n') * (size // (len(line) + 1))
+    return ('<div created="20180101000000000" modified="20180101000000000" '
+        'title="$:/plugins/synthetic/blob{}" type="application/json">\n'
+        '<pre>{}</pre></div>\n').format(n or '', body)
+
+def make_wiki(path, ntiddlers, body_size=200, ntags=50, plugin_size=0, 
+    template=TEMPLATE, tags_per_tiddler=1, nplugins=1):
+    """Write a synthetic wiki to `path`.
+
+    :param str path: Output file.
+    :param int ntiddlers: Number of tiddlers.
+    :param int body_size: Approximate size of each tiddler body in bytes.
+    :param int ntags: Number of distinct `param` tags.
+    :param int plugin_size: Size of an embedded plugin-like tiddler in bytes. 
+    :param str template: Wiki supplying the header and the trailer.
+    :param int tags_per_tiddler: Number of `param` tags of each tiddler.
+    :param int nplugins: Number of plugin-like tiddlers when `plugin_size`.
+    :return: `path`
+    """
+    tw = figure_portfolio.TiddlyWikiParse(template)
+    tw.read()
+    with open(path, encoding='utf-8', mode='w') as out:
+        out.writelines(tw.headerlines)
+        if plugin_size:
+            for n in range(nplugins):
+                out.write(plugin_block(plugin_size, n))
+        for i in range(ntiddlers):
+            out.write(tiddler_block(i, body_size, ntags, tags_per_tiddler))
+        out.writelines(tw.trailerlines)
+    return path
@@ -9,12 +9,47 @@ Created on Fri Feb  9 21:41:28 2018
 """
 
 import datetime
+import bisect
 import re
+import sys
 import html
 from html.parser import HTMLParser
 import os
+import glob
+import fnmatch
+import urllib.parse
 import tempfile
 import shutil
+import mmap
+import struct
+import zlib
+import json
+import base64
+import mimetypes
+import hashlib
+import time
+import functools
+import contextlib
+import cProfile
+import tracemalloc
+import uuid
+import sqlite3
+import socket
+import socketserver
+import threading
+import concurrent.futures
+try:
+    from PIL import Image
+except ImportError:     # thumbnails are not available
+    Image = None
+try:
+    import fcntl
+except ImportError:     # not on Windows
+    fcntl = None
+try:
+    import resource
+except ImportError:     # not on Windows
+    resource = None
 
 class MyHTMLParser(HTMLParser):
     """Extract information out of div element. """
@@ -22,6 +57,8 @@ class MyHTMLParser(HTMLParser):
         if tag == "div":
             self.divattrs = dict(attrs)
 
+regimage = re.compile(r'\[!\[image\]\([^)]*\)\]\(([^)]*)\)|!\[image\]\(([^)]*)\)')
+# the image linked from a thumbnail, [![image](thumb)](image), or ![image](image)
 regtag = re.compile(r'(?:\[\[)[\w ]+(?:\]\])'
             '|\w+') 
 # [[ any number of (a-zA-Z0-9(SPC))]] or any number of (a-zA-Z0-9) 
@@ -29,35 +66,457 @@ regtag = re.compile(r'(?:\[\[)[\w ]+(?:\]\])'
 # t = 'blue [[red dot]] [[my red Z]] brown'
 # regtag.findall(t) # returns ['blue', '[[red dot]]', '[[my red Z]]', 'brown']
 
+regdivattr = re.compile(r'([\w:.-]+)="([^"]*)"')
+# name="value" pairs in the opening <div ...> line of a tiddler.
+# TiddlyWiki escapes '"', '<' and '>' in the attribute values.
+
+def splitlines(text):
+    """Split `text` after each '\\n' as `readlines()` does. """
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [l + '\n' for l in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+def write_block(fp, block):
+    """Write the block of a tiddler, see `Tiddler.block()`.
+
+    :return: Number of bytes written.
+    """
+    if type(block) == str:
+        return fp.write(block.encode('utf-8'))
+    if type(block) == bytes:
+        return fp.write(block)
+    return sum(fp.write(chunk) for chunk in block)
+
+def peak_memory():
+    """Peak memory of the process in bytes: the peak traced by `tracemalloc` 
+    since its last reset when it is tracing, else the maximum resident set 
+    size, or 0 when neither is available. """
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    if resource == None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class Stats(object):
+    """Wall time, calls and peak memory of the phases of an `addtiddler()` 
+    call, and counters such as the bytes read and written. 
+
+    The phases nest: `read_tiddler` and `tags` are part of `read`. While 
+    `tracemalloc` is tracing (`instrument()` starts it when `memory` is 
+    set), the peak of a phase is the peak of the memory traced from its 
+    start to its end: the peak is reset at the start of each phase and 
+    passed on to the phases around it. Otherwise it is the maximum resident 
+    set size of the process so far.
+    """
+    def __init__(self, memory=True):
+        """Constructor
+
+        :param boolean memory: Trace the memory with `tracemalloc` during 
+         `instrument()`. Tracing slows down the phases that allocate much, 
+         so their times are larger than without `Stats`.
+        """
+        self.memory = memory
+        self.phases = {}
+        self.counters = {}
+        self.running = []   # the traced peak so far of the running phases
+        self.peak = 0
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def begin(self):
+        """Start a phase.
+
+        :return: Token for `end()`.
+        """
+        if tracemalloc.is_tracing():
+            self.fold(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.running.append(0)
+        return time.perf_counter()
+
+    def end(self, phase, started, calls=1):
+        """Record `calls` calls of `phase` started by `begin()`. """
+        seconds = time.perf_counter() - started
+        peak = self.running.pop()
+        if tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            self.fold(peak)
+        else:
+            peak = peak_memory()
+        p = self.phases.get(phase)
+        if p == None:
+            p = self.phases[phase] = dict(seconds=0.0, calls=0, peak_memory=0)
+        p['seconds'] += seconds
+        p['calls'] += calls
+        p['peak_memory'] = max(p['peak_memory'], peak)
+
+    def fold(self, peak):
+        """Pass a traced `peak` to the running phases and the whole call. """
+        self.running = [max(r, peak) for r in self.running]
+        self.peak = max(self.peak, peak)
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """Context manager recording one call of `phase`. """
+        started = self.begin()
+        try:
+            yield self
+        finally:
+            self.end(phase, started)
+
+    def count(self, counter, n=1):
+        """Add `n` to `counter`. """
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def stop(self):
+        """Stop the clock of the whole call. """
+        self.seconds = time.perf_counter() - self.started
+        if tracemalloc.is_tracing():
+            self.fold(tracemalloc.get_traced_memory()[1])
+
+    def as_dict(self):
+        """The statistics as a dict that `json.dumps()` accepts. """
+        seconds = self.seconds
+        if seconds == None:
+            seconds = time.perf_counter() - self.started
+        peak = self.peak
+        if tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        elif peak == 0:
+            peak = peak_memory()
+        return dict(seconds=seconds, peak_memory=peak, 
+            phases=self.phases, counters=self.counters)
+
+    def emit(self, output='-', **fields):
+        """Print the statistics as one JSON line, or append it to the file 
+        `output`. `fields` are added to the line, e.g. the name of the call. """
+        record = dict(fields)
+        record.update(self.as_dict())
+        line = json.dumps(record, sort_keys=True)
+        if output == '-':
+            print(line)
+        else:
+            with open(output, encoding='utf-8', mode='a') as fp:
+                fp.write(line + '\n')
+
+def timed(phase):
+    """Decorator recording the calls of a method in `self.stats`, a `Stats` 
+    or `None`. """
+    def decorate(method):
+        @functools.wraps(method)
+        def timed_method(self, *args, **kwargs):
+            if self.stats == None:
+                return method(self, *args, **kwargs)
+            started = self.stats.begin()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stats.end(phase, started)
+        return timed_method
+    return decorate
+
+def env_option(name):
+    """The value of the environment variable `name`, or `False` when it is 
+    unset, empty, `0` or `false`. """
+    value = os.environ.get(name, '')
+    if value.lower() in ('', '0', 'false'):
+        return False
+    return value
+
+@contextlib.contextmanager
+def instrument(call, stats=None, profile=None, **fields):
+    """Measure a call of `addtiddler()` or `addtiddlers()`.
+
+    :param str call: Name of the call, written in the JSON line.
+    :param stats: `True` or `'-'` prints the statistics of the call as one 
+     JSON line (see `Stats.emit()`), a path appends the line to that file, 
+     and a `Stats` collects them for the caller without printing. `None` 
+     takes the value of the environment variable `FIGURE_PORTFOLIO_STATS` 
+     (`1` prints; empty, `0` or `false` is off), so that the statistics can 
+     be turned on without changing the scripts; `False` turns them off.
+    :param str profile: Path of a `cProfile` dump of the whole call, or the 
+     environment variable `FIGURE_PORTFOLIO_PROFILE` when `None`; `False` 
+     for none.
+    :param fields: Added to the JSON line.
+    :return: The `Stats` of the call, or `None`.
+    """
+    if stats == None:
+        stats = env_option('FIGURE_PORTFOLIO_STATS')
+    if profile == None:
+        profile = env_option('FIGURE_PORTFOLIO_PROFILE')
+    output = None
+    if stats is True or stats in ('1', '-'):
+        stats, output = Stats(), '-'
+    elif stats and not isinstance(stats, Stats):
+        stats, output = Stats(), stats
+    stats = stats or None
+    tracing = stats != None and stats.memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield stats
+    finally:
+        if profiler != None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if stats != None:
+            stats.stop()
+        if tracing:
+            tracemalloc.stop()
+        if output != None:
+            stats.emit(output, call=call, **fields)
+
 class Tiddler(object):
-    """Keeps the tiddler text, title, created and modified date, tags."""
-    def __init__(self, text):
+    """Keeps the tiddler text, title, created and modified date, tags.
+
+    The record is kept small for wikis of many tiddlers: `__slots__`, the 
+    text in one string, interned tags, and the dates taken out of the first 
+    line on first use.
+    """
+    __slots__ = ('_text', 'source', 'title', 'tags', '_stamps')
+
+    def __init__(self, text, source=None):
         """Constructor
 
-        :param list text: List of the text lines for the tiddler object.
+        :param text: The text of the tiddler, as a list of lines or one 
+         string. `None` when the text is kept in `source`.
+        :type text: list or str
+        :param tuple source: `(mapping, start, end)`, the byte range of the 
+         tiddler in a memory-mapped wiki. The text is decoded on demand.
         """
-        self.text = text
-        self.taglist = []
+        self._text = ''.join(text) if type(text) == list else text
+        self.source = source
+        self._stamps = None
+
+    @property
+    def text(self):
+        """List of the text lines. Split from the text, or decoded from 
+        `source` for the memory-mapped tiddlers, at every access."""
+        if self._text is None:
+            mapping, start, end = self.source
+            return splitlines(mapping[start:end].decode('utf-8'))
+        return splitlines(self._text)
+
+    @text.setter
+    def text(self, text):
+        self._text = ''.join(text) if type(text) == list else text
+        self.source = None
+
+    @property
+    def created(self):
+        """The created date, `YYYYmmddHHMMSSfff`. """
+        if self._stamps is None:
+            self.parse_stamps()
+        return self._stamps[0]
+
+    @created.setter
+    def created(self, created):
+        self._stamps = (created, self.modified)
+
+    @property
+    def modified(self):
+        """The modified date, `YYYYmmddHHMMSSfff`. """
+        if self._stamps is None:
+            self.parse_stamps()
+        return self._stamps[1]
+
+    @modified.setter
+    def modified(self, modified):
+        self._stamps = (self.created, modified)
+
+    def head(self):
+        """The first line of the tiddler. """
+        if self._text is None:
+            mapping, start, end = self.source
+            eol = mapping.find(b'\n', start, end)
+            return mapping[start:eol + 1].decode('utf-8')
+        return self._text[:self._text.find('\n') + 1 or len(self._text)]
+
+    def raw(self):
+        """The tiddler as utf-8 bytes. The memory-mapped range is copied as 
+        it is. """
+        if self._text is None:
+            mapping, start, end = self.source
+            return mapping[start:end]
+        return self._text.encode('utf-8')
+
+    def block(self):
+        """The tiddler in one piece: bytes of the memory-mapped range, or the 
+        text, which `TiddlyWikiParse.publish()` encodes together with the 
+        neighbouring tiddlers. """
+        if self._text is None:
+            return self.raw()
+        return self._text
+
+    def divattrs(self, fast=True):
+        """Attributes of the opening div element. They are taken out of the 
+        first line with `regdivattr`; `MyHTMLParser` is used when `fast` is 
+        `False` or the first line is not a complete div tag.
+        """
+        head = self.head()
+        end = head.find('>')
+        if fast and head.startswith('<div ') and end > 0:
+            return {name.lower(): html.unescape(value) 
+                for name, value in regdivattr.findall(head, 0, end)}
+        return self.parse_html()
         
-    def parse(self):
-        """Parse the Tiddler contents. """
-        parser = MyHTMLParser()
-        parser.feed(''.join(self.text))
-        self.title = parser.divattrs.get('title')
-        self.created = parser.divattrs.get('created')
+    def parse(self, fast=True):
+        """Parse the Tiddler contents. 
+
+        Only the attributes of the opening div element are needed, and the 
+        body is not parsed. The dates are parsed when they are first used. 
+        """
+        divattrs = self.divattrs(fast)
+        self.title = divattrs.get('title')
+        if not fast:
+            self._stamps = (divattrs.get('created'), divattrs.get('modified'))
         if not self.title.startswith(r'$:/'):
-            divtags = parser.divattrs.get('tags')
+            divtags = divattrs.get('tags')
             if divtags:
-                self.tags = regtag.findall(divtags)
+                self.tags = [sys.intern(t) for t in regtag.findall(divtags)]
+
+    def parse_stamps(self):
+        """Set the created and modified dates from the first line. """
+        divattrs = self.divattrs()
+        self._stamps = (divattrs.get('created'), divattrs.get('modified'))
         
+    def parse_html(self):
+        """Attributes of the div element, with `MyHTMLParser`. The lines are 
+        fed up to the end of the opening tag.
+        """
+        parser = MyHTMLParser()
+        for line in self.text:
+            parser.feed(line)
+            if hasattr(parser, 'divattrs'):
+                break
+        return parser.divattrs
+
     def __repr__(self):
         return self.title + ": " + ''.join(self.text)[:40]
 
+def encode_chunk(path, offset, size):
+    """Read `size` bytes of `path` at `offset` and encode them in base64. 
+    `size` must be a multiple of 3 except at the end of the file, so that 
+    the encoded chunks can be concatenated.
+    """
+    with open(path, mode='rb') as fp:
+        fp.seek(offset)
+        return base64.b64encode(fp.read(size))
+
+class ImageTiddler(Tiddler):
+    """A tiddler holding an image file in base64, the way TiddlyWiki stores 
+    binary tiddlers. 
+
+    The file is only read when the tiddler is written: `block()` yields the 
+    encoded image in chunks, so that a large set of images never sits in 
+    memory. `text` is the tiddler without the image data.
+    """
+    __slots__ = ('image', 'size', 'pool', 'chunksize', 'prefetched')
+
+    def __init__(self, head, image, pool=None, chunksize=3 * 2**18):
+        """Constructor
+
+        :param str head: The opening div element, with the type of the image.
+        :param str image: Path to the image file.
+        :param pool: Executor encoding the chunks in parallel. The next 
+         chunks are encoded while the current one is written.
+        :type pool: concurrent.futures.Executor
+        :param int chunksize: Bytes of the image encoded at once, a multiple 
+         of 3. The default, 768 KiB, gives 1 MiB of base64.
+        """
+        Tiddler.__init__(self, head + '<pre></pre></div>\n')
+        self.image = image
+        self.size = os.path.getsize(image)
+        self.pool = pool
+        self.chunksize = chunksize
+        self.prefetched = None
+
+    def prefetch(self):
+        """Start encoding the first chunk of the image on the pool, before 
+        the tiddler is written (see `TiddlyWikiParse.blocks()`). """
+        if self.pool != None and self.prefetched == None and self._text != None:
+            self.prefetched = self.pool.submit(encode_chunk, self.image, 0, 
+                self.chunksize)
+
+    def block(self):
+        """The tiddler as a generator of utf-8 chunks, or the mapped range 
+        once the wiki is remapped (see `TiddlyWikiParse.remap()`). """
+        if self._text is None:
+            return Tiddler.block(self)
+        return self.chunks()
+
+    def chunks(self):
+        """Generator of the utf-8 bytes of the tiddler. """
+        pre = self._text.index('</pre>')
+        yield self._text[:pre].encode('utf-8')
+        offsets = range(0, self.size, self.chunksize)
+        first, self.prefetched = self.prefetched, None
+        if first != None:
+            yield first.result()
+            offsets = offsets[1:]
+        if self.pool == None or len(offsets) < 2:
+            for offset in offsets:
+                yield encode_chunk(self.image, offset, self.chunksize)
+        else:
+            ahead = 2 * (os.cpu_count() or 1)
+            futures = []
+            for offset in offsets:
+                futures.append(self.pool.submit(encode_chunk, self.image, 
+                    offset, self.chunksize))
+                if len(futures) > ahead:
+                    yield futures.pop(0).result()
+            for future in futures:
+                yield future.result()
+        yield self._text[pre:].encode('utf-8')
+
+    def raw(self):
+        if self._text is None:
+            return Tiddler.raw(self)
+        return b''.join(self.chunks())
+
 class TiddlyWikiParse(object):
-    def __init__(self, infile): 
-        """Constructor. `infile` is opened by the call `self.read()`. """
+    sortedfields = ('title', 'created', 'modified')     # see query_index()
+
+    def __init__(self, infile, lazy=False, cache=False): 
+        """Constructor. `infile` is opened by the call `self.read()`. 
+
+        :param str infile: TiddlyWiki file.
+        :param boolean lazy: Memory-map the file and keep only the byte 
+         ranges of the tiddlers instead of their text. 
+        :param boolean cache: Keep the metadata and the byte ranges of the 
+         tiddlers in the sidecar file `infile + '.fpidx'`, and load them from 
+         there while it matches the wiki. Implies `lazy`.
+
+        Set `self.stats` to a `Stats` to record the phases of the calls.
+        """
         self.infile = infile
+        self.lazy = lazy or cache
+        self.cache = cache
+        self.mapping = None
+        self.ranges = None
+        self.nstored = 0
+        self.rewrite = False
+        self.titleindex = None
+        self.suffixhint = {}
+        self.tagcount = None
+        self.tagversion = 0
+        self.tagindex = None
+        self.sortedindex = None
+        self.batchstamp = None
+        self.tagsections = {}
+        self.tagletters = {}
+        self.imagetiddlers = set()  # see blocks()
+        self.stats = None
 
+    @timed('read_header')
     def read_header(self):
         """Reads the part from the top to just before the tiddlers. """
         endofheader = '<div id="storeArea" style="display:none;">\n'
@@ -92,59 +551,317 @@ class TiddlyWikiParse(object):
             self.trailerlines.append(line)
             line = self.infile.readline()
 
+    @timed('read')
     def read(self): 
         """Read all the text of a tiddly wiki file."""
+        recover_journal(self.infile)
+        self.filestat = os.stat(self.infile)
+        self.tagindex = self.sortedindex = None
+        self.imagetiddlers = set()
+        if self.lazy:
+            return self.read_mapped()
         self.tiddlers = []
         with open(self.infile, encoding="utf-8", mode='r') as infile:
             self.infile = infile
 
             self.read_header()
+            if self.stats != None:
+                started = self.stats.begin()
             r = self.read_tiddler()
             while r:
                 self.tiddlers.append(r)
                 r = self.read_tiddler()
             self.read_trailer()
+            if self.stats != None:
+                self.stats.end('read_tiddler', started, len(self.tiddlers))
+                self.stats.count('bytes_read', self.filestat.st_size)
         
+        self.stored()
+
+    def stored(self):
+        """Mark the tiddlers as the ones in the file. """
+        self.nstored = len(self.tiddlers)
+        self.rewrite = False
+        self.index_titles()
         self.tags()
 
+    def read_mapped(self):
+        """Memory-map the tiddly wiki file and find the byte range of each 
+        tiddler. The header and the trailer are read as lines, the tiddlers 
+        keep only their metadata. The file must use '\\n' line endings.
+        """
+        self.open_mapping(self.infile)
+        if self.cache and self.load_index(self.infile):
+            return None
+        if self.stats != None:
+            started = self.stats.begin()
+        mm = self.mapping
+        endofheader = b'<div id="storeArea" style="display:none;">\n'
+        pos = mm.find(endofheader) + len(endofheader)
+        self.headerlines = splitlines(mm[:pos].decode('utf-8'))
+        if self.stats != None:
+            self.stats.end('read_header', started)
+            started = self.stats.begin()
+        trailer = mm.find(b'\n<!--~~ Library modules ~~-->\n', pos - 1)
+        trailer = len(mm) if trailer < 0 else trailer + 1
+        self.tiddlers = []
+        self.ranges = []
+        while True:
+            div = mm.find(b'\n<div created=', pos - 1, trailer)
+            if div < 0:
+                break
+            end = mm.find(b'</div>\n', div) + len(b'</div>\n')
+            r_tiddler = Tiddler(None, (mm, pos, end))
+            r_tiddler.parse()
+            self.tiddlers.append(r_tiddler)
+            self.ranges.append((pos, end))
+            pos = end
+        self.trailerlines = splitlines(mm[pos:].decode('utf-8'))
+        if self.stats != None:
+            self.stats.end('read_tiddler', started, len(self.tiddlers))
+            self.stats.count('bytes_read', len(mm))
+
+        self.stored()
+        if self.cache:
+            self.save_index(self.infile)
+
+    @timed('load_index')
+    def load_index(self, path):
+        """Load the tiddlers of the mapped `path` from its sidecar index. 
+
+        :return: `False` when there is no index or it does not match `path`.
+        """
+        try:
+            with open(path + '.fpidx', encoding='utf-8') as fp:
+                index = json.load(fp)
+                if self.stats != None:
+                    self.stats.count('bytes_read', os.fstat(fp.fileno()).st_size)
+        except (OSError, ValueError):
+            return False
+        if index.get('version') != 1 or index.get('key') != index_key(path):
+            return False
+        mm = self.mapping
+        header, trailer = index['header'], index['trailer']
+        self.headerlines = splitlines(mm[:header].decode('utf-8'))
+        self.trailerlines = splitlines(mm[trailer:].decode('utf-8'))
+        self.tiddlers = []
+        self.ranges = []
+        for title, start, end, created, modified, tags in index['tiddlers']:
+            r_tiddler = Tiddler(None, (mm, start, end))
+            r_tiddler.title = title
+            r_tiddler._stamps = (created, modified)
+            if tags:
+                r_tiddler.tags = tags
+            self.tiddlers.append(r_tiddler)
+            self.ranges.append((start, end))
+        self.stored()
+        return True
+
+    def save_index(self, path):
+        """Write the sidecar index `path + '.fpidx'` of the tiddlers as they 
+        are stored in `path`, the file just read or written. """
+        if self.ranges:
+            header, trailer = self.ranges[0][0], self.ranges[-1][1]
+        else:
+            header = len(''.join(self.headerlines).encode('utf-8'))
+            trailer = header
+        index = dict(version=1, key=index_key(path), header=header, 
+            trailer=trailer, tiddlers=[[td.title, start, end, td.created, 
+                td.modified, getattr(td, 'tags', None)] 
+                for td, (start, end) in zip(self.tiddlers, self.ranges)])
+        tmpfile = path + '.fpidx.tmp'
+        with open(tmpfile, encoding='utf-8', mode='w') as fp:
+            json.dump(index, fp, separators=(',', ':'))
+        os.replace(tmpfile, path + '.fpidx')
+
+    def open_mapping(self, path):
+        """Open `path` and map it read-only to `self.mapping`. """
+        self.close()
+        self.mapfile = open(path, mode='rb')
+        self.mapping = mmap.mmap(self.mapfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def remap(self, path):
+        """Map `path`, the file just written by `publish()` or 
+        `append_tiddlers()`, and point every tiddler at its range in it, so 
+        that the edited tiddlers are no longer kept in memory.
+
+        Without `self.lazy`, only the embedded images are mapped, so that 
+        they are no longer read from their image files, which may be changed 
+        or removed before the wiki is written again.
+        """
+        pairs = zip(self.tiddlers, self.ranges)
+        if not self.lazy:
+            pairs = [(td, r) for td, r in pairs if r != None 
+                and (td._text is None or td in self.imagetiddlers)]
+            if not pairs:
+                self.imagetiddlers = set()
+                return None
+        self.open_mapping(path)
+        for td, (start, end) in pairs:
+            td.source = (self.mapping, start, end)
+            td._text = None
+        self.imagetiddlers = set()
+
+    def close(self):
+        """Release the memory map of a lazy wiki. """
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapfile.close()
+            self.mapping = None
+
+    def index_titles(self):
+        """Build the title -> index dictionary used by `find_tiddler()`. 
+        When a title appears twice, the first tiddler is kept as the linear 
+        search did. 
+        """
+        self.titleindex = {}
+        for i, td in enumerate(self.tiddlers):
+            self.titleindex.setdefault(td.title, i)
+        self.suffixhint = {}
+
+    @timed('tags')
     def tags(self):
-        """Collect the tag used in the tiddlers."""
-        self.taglist = []
+        """Collect the tag used in the tiddlers.
+
+        `self.tagcount` is an insertion-ordered dictionary tag -> number of 
+        tiddlers with the tag, in the order the tags first appear. 
+        `self.taglist` is a snapshot of its keys. 
+        """
+        self.tagcount = {}
         for td in self.tiddlers:
-            try:
-                for tag in td.tags:
-                    if tag not in self.taglist:   # might be simpler with set
-                        self.taglist.append(tag)  # however, list keep the order
-            except AttributeError:
-                pass
+            self.count_tags(td, 1)
+        self.taglist = list(self.tagcount)
+
+    def count_tags(self, tiddler, step):
+        """Update `self.tagcount` for a tiddler added (`step=1`) or 
+        removed (`step=-1`). `self.tagversion` is incremented when a tag is 
+        used for the first time or is no longer used by any tiddler. 
+        New tags are put at the end of the registry.
+        """
+        if self.tagcount is None:   # collected later by self.tags()
+            return None
+        for tag in dict.fromkeys(getattr(tiddler, 'tags', ())):
+            n = self.tagcount.get(tag, 0) + step
+            if n > 0:
+                self.tagcount[tag] = n
+                if n == 1 and step > 0:
+                    self.tagversion += 1
+            else:
+                del self.tagcount[tag]
+                self.tagversion += 1
 
     def find_tiddler(self, title):
         """Find a tiddler by its title.
         
         :param str title: Title of tiddler.
+        :return: Index in `self.tiddlers` and the created date, or 
+         `(None, None)` when not found.
+        """
+        if self.titleindex is None:
+            self.index_titles()
+        i = self.titleindex.get(title)
+        if i is None:
+            return None, None
+        return i, self.tiddlers[i].created
+
+    def free_title(self, title):
+        """Find the first free title 'title-01' ... 'title-99'.
+
+        The next suffix to try is kept for each `title`, so repeated inserts 
+        under the same title do not probe the used slots again.
+
+        :param str title: Title of the existing tiddler.
+        :return: New title, or `None` when all the 99 titles are used.
+        """
+        if self.titleindex is None:
+            self.index_titles()
+        i = self.suffixhint.get(title, 1)
+        while i < 100:
+            tlnext = title + '-{0:02d}'.format(i)
+            if tlnext not in self.titleindex:
+                break
+            i += 1
+        self.suffixhint[title] = i
+        if i < 100:
+            return tlnext
+        return None
+
+    def remove_tiddler(self, title):
+        """Remove a tiddler by its title.
+
+        :param str title: Title of tiddler.
+        :return: Removed Tiddler, or `None` when not found.
+        """
+        index, created = self.find_tiddler(title)
+        if index is None:
+            return None
+        tiddler = self.tiddlers.pop(index)
+        self.count_tags(tiddler, -1)
+        self.tagindex = self.sortedindex = None     # the indices moved
+        if index < self.nstored:
+            self.rewrite = True
+        del self.titleindex[title]
+        for i in range(index, len(self.tiddlers)):
+            if self.titleindex.get(self.tiddlers[i].title) == i + 1:
+                self.titleindex[self.tiddlers[i].title] = i
+        base, sep, num = title.rpartition('-')
+        if sep and len(num) == 2 and num.isdigit() and base in self.suffixhint:
+            self.suffixhint[base] = min(self.suffixhint[base], int(num))
+        return tiddler
+
+    @timed('taglist_tiddler')
+    def taglist_tiddler(self, split=False):
+        """Generate a tiddler `Tag List` listing all tags. 
+
+        The escaped section of each tag is kept in `self.tagsections`, so 
+        only the new tags are formatted when the list is generated again. 
+        With `split`, the sections go to one sub-tiddler per first letter, 
+        `Tag List/A`, `Tag List/B`..., listed by `Tag List`, and only the 
+        sub-tiddlers whose tags changed are generated again. A tiddler whose 
+        text would not change, such as the ones of a wiki just read, is kept 
+        as it is stored (see `generated_tiddler()`).
+        """
+        old = self.tagsections
+        if list(old) != self.taglist:
+            self.tagsections = {t: old.get(t) or tag_section(t) for t in self.taglist}
+        if not split:
+            self.generated_tiddler('Tag List', ''.join(self.tagsections.values()))
+            return None
+        letters = {}
+        for t, section in self.tagsections.items():
+            letters.setdefault(tag_letter(t), []).append(t)
+        for letter in sorted(set(letters) | set(self.tagletters)):
+            title = 'Tag List/' + letter
+            if letter not in letters:
+                self.remove_tiddler(title)
+            elif self.tagletters.get(letter) != letters[letter] \
+                or self.find_tiddler(title)[0] is None:
+                self.generated_tiddler(title, ''.join(self.tagsections[t] 
+                    for t in letters[letter]))
+        if sorted(letters) != sorted(self.tagletters) \
+            or self.find_tiddler('Tag List')[0] is None:
+            self.generated_tiddler('Tag List', ''.join('* [[Tag List/{}]]\n'.format(l) 
+                for l in sorted(letters)))
+        self.tagletters = letters
+
+    def generated_tiddler(self, title, body):
+        """Create or replace the tiddler `title` with the escaped `body`. 
+        An existing tiddler with the same `body` is left as it is, so that 
+        it is not restamped and the wiki can still be appended to.
         """
-        for i, td in enumerate(self.tiddlers):
-            if title == td.title: #replace = True
-                return i, self.tiddlers[i].created
-        return None, None
-
-    def taglist_tiddler(self):
-        """Generate a tiddler `Tag List` listing all tags. """
-        title = 'Tag List'
-        modified = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")[:-3]        
         index, created = self.find_tiddler(title)
+        if index is not None:
+            text = ''.join(self.tiddlers[index].text)
+            if text[text.find('\n') + 1:] == '<pre>' + body + '\n</pre></div>\n':
+                return None
+        modified = self.timestamp()
         if created == None:
             created = modified
-        ptext = ''
-        for t in self.taglist:
-            if t.startswith("[[") and t.endswith("]]"):
-                t = t[2:-2]
-            ptext += '!!! {}\n'.format(t)
-            ptext += '<<list-links "[tag[{}]]">>\n'.format(t)
-        tags = ''
         # "20180210 0511 39454"
-        self.tiddler_generate(title, ptext, tags, created, modified, index)
+        self.tiddler_generate(title, body, '', created, modified, index, 
+            escaped=True)
 
+    @timed('new_tiddler')
     def new_tiddler(self, title, ptext, tags, replace):
         """Collect the parameter and call `tiddler_generate()`.
         
@@ -155,29 +872,29 @@ class TiddlyWikiParse(object):
         :param boolean replace: Replace the existing tiddler when an old one exists. 
         """
         tidtype = 'text/x-markdown'
-        modified = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")[:-3]        
+        modified = self.timestamp()
         index, created = self.find_tiddler(title)
         if replace:
             tlnext = title
             if created == None:
                 created = modified
         else:
-            if index:
-                for i in range(1, 100):
-                    tlnext = title + '-{0:02d}'.format(i)
-                    index, created = self.find_tiddler(tlnext)
-                    if index == None:
-                        created = modified
-                        break
+            if index is not None:
+                tlnext = self.free_title(title)
+                if tlnext is not None:
+                    index, created = None, modified
                 else: 
+                    tlnext = title + '-99'
                     msg = "Warning: Overwriting the 100 th tiddler '{}' "
                     print(msg.format(tlnext))
-                    # index is self.finde_tiddler(title + '-99') [0]
+                    index, created = self.find_tiddler(tlnext)
             else:
                 tlnext = title
+                created = modified
         self.tiddler_generate(tlnext, ptext, tags, created, modified, index, tidtype)
 
-    def tiddler_generate(self, title, ptext, tags, created, modified, index, tidtype=''):
+    def tiddler_generate(self, title, ptext, tags, created, modified, index, 
+        tidtype='', escaped=False):
         """Create a `Tiddler`.
     
         :param str title: Title of the tiddler
@@ -189,6 +906,7 @@ class TiddlyWikiParse(object):
         :param int index: `self.tidders[index]` is replaced with new tiddler. 
          If index is `None` the new tiddler is appended.
         :param str tidtype: Tiddler type `markdown` or empty for native format. 
+        :param boolean escaped: `ptext` is already HTML-escaped.
         :returns: Generated Tiddler.
         """
         tagstr = ''
@@ -202,28 +920,471 @@ class TiddlyWikiParse(object):
         tidd_hdr += 'tags="{tags}" title="{title}" type="{tidtype}">\n'
         tidd_hdr = tidd_hdr.format(created=created, modified=modified, tags=tagstr, 
             title=title, tidtype=tidtype)
-        tidd_tlr = '\n</pre></div>'
-        tidd_cnts = '<pre>{description}'.format(description=html.escape(ptext))
-        tmp = tidd_hdr + tidd_cnts + tidd_tlr
-        tmp = tmp.split('\n')
-        tmp = [t + '\n' for t in tmp]
-        tiddler = Tiddler(tmp)
+        tidd_tlr = '\n</pre></div>\n'
+        tidd_cnts = '<pre>' + (ptext if escaped else html.escape(ptext))
+        self.place_tiddler(Tiddler(tidd_hdr + tidd_cnts + tidd_tlr), index)
+
+    @timed('new_image_tiddler')
+    def new_image_tiddler(self, title, image, pool=None):
+        """Embed an image file as a tiddler titled `title`, replacing the 
+        tiddler of the same title. PNG, JPEG, GIF... are stored in base64 
+        (see `ImageTiddler`), SVG as text.
+
+        :param str title: Title of the image tiddler.
+        :param str image: Path to the image file.
+        :param pool: Executor encoding the chunks of the image.
+        :type pool: concurrent.futures.Executor
+        """
+        tidtype = mimetypes.guess_type(image)[0] or 'image/png'
+        modified = self.timestamp()
+        index, created = self.find_tiddler(title)
+        if created == None:
+            created = modified
+        head = '<div created="{}" modified="{}" title="{}" type="{}">\n'.format(
+            created, modified, html.escape(title), tidtype)
+        if tidtype == 'image/svg+xml':
+            with open(image, encoding='utf-8') as fp:
+                svg = html.escape(fp.read())
+            self.place_tiddler(Tiddler([head] + splitlines('<pre>' + svg 
+                + '</pre></div>\n')), index)
+        else:
+            tiddler = ImageTiddler(head, image, pool)
+            self.imagetiddlers.add(tiddler)
+            self.place_tiddler(tiddler, index)
+
+    def place_tiddler(self, tiddler, index):
+        """Put a new `Tiddler` at `index`, or after the others when `index` is 
+        `None`, and update the title index and the tag counts.
+        """
         tiddler.parse()
-        if index:
+        if self.titleindex is None:
+            self.index_titles()
+        self.count_tags(tiddler, 1)
+        if index is not None and self.tagindex is not None:
+            self.unindex_tiddler(self.tiddlers[index], index)
+        if index is not None:
+            oldtitle = self.tiddlers[index].title
+            if self.titleindex.get(oldtitle) == index:
+                del self.titleindex[oldtitle]
+            self.count_tags(self.tiddlers[index], -1)
             self.tiddlers[index] = tiddler
+            if index < self.nstored:
+                self.rewrite = True
         else:
+            index = len(self.tiddlers)
             self.tiddlers.append(tiddler)
+        self.titleindex.setdefault(tiddler.title, index)
+        if self.tagindex is not None:
+            self.index_tiddler(tiddler, index)
+
+    def timestamp(self):
+        """The created/modified stamp of new tiddlers: `self.batchstamp` 
+        when a batch set it, so that the tiddlers of one batch share it, or 
+        the current UTC time. """
+        if self.batchstamp is not None:
+            return self.batchstamp
+        return utcstamp()
+
+    def sort_value(self, tiddler, field):
+        """Value of `field` in the sorted index: the title, or the integer 
+        of a date (see `stamp_value()`). """
+        value = getattr(tiddler, field, None)
+        if field == 'title' or value is None:
+            return value
+        return stamp_value(value)
+
+    def query_index(self):
+        """Build the indexes of `query()`: `self.tagindex`, tag -> set of 
+        the indices of the tiddlers with the tag, and `self.sortedindex`, 
+        field -> sorted list of `(value, index)` for the titles and the 
+        created and modified dates, the dates as integers. They are built on the first query after 
+        `read()` and kept up to date as tiddlers are added or replaced.
+        """
+        self.tagindex = {}
+        self.sortedindex = {}
+        for field in self.sortedfields:
+            values = ((self.sort_value(td, field), i) for i, td in enumerate(self.tiddlers))
+            self.sortedindex[field] = sorted(v for v in values if v[0] is not None)
+        for i, td in enumerate(self.tiddlers):
+            for tag in getattr(td, 'tags', ()):
+                self.tagindex.setdefault(tag, set()).add(i)
+
+    def index_tiddler(self, tiddler, index):
+        """Add the tiddler at `index` to the query indexes. """
+        for tag in getattr(tiddler, 'tags', ()):
+            self.tagindex.setdefault(tag, set()).add(index)
+        for field in self.sortedfields:
+            value = self.sort_value(tiddler, field)
+            if value is not None:
+                bisect.insort(self.sortedindex[field], (value, index))
+
+    def unindex_tiddler(self, tiddler, index):
+        """Remove the tiddler at `index` from the query indexes. """
+        for tag in getattr(tiddler, 'tags', ()):
+            self.tagindex.get(tag, set()).discard(index)
+        for field in self.sortedfields:
+            value = self.sort_value(tiddler, field)
+            if value is None:
+                continue
+            entries = self.sortedindex[field]
+            pos = bisect.bisect_left(entries, (value, index))
+            if pos < len(entries) and entries[pos] == (value, index):
+                del entries[pos]
+
+    def select_range(self, field, since=None, until=None):
+        """Indices of the tiddlers with `since <= field < until`; either end 
+        may be `None`. The dates are given as integers or as prefixes of the 
+        stamps (see `stamp_value()`). """
+        if field != 'title':
+            since, until = stamp_value(since), stamp_value(until)
+        entries = self.sortedindex[field]
+        lo = 0 if since is None else bisect.bisect_left(entries, (since,))
+        hi = len(entries) if until is None else bisect.bisect_left(entries, (until,))
+        return {i for value, i in entries[lo:hi]}
+
+    def latest(self, n, field='modified'):
+        """The `n` tiddlers modified (or created) last, the latest first. 
+
+        :param int n: Number of tiddlers.
+        :param str field: `'modified'` or `'created'`.
+        :return: List of the tiddlers.
+        """
+        if self.sortedindex is None:
+            self.query_index()
+        entries = self.sortedindex[field]
+        return [self.tiddlers[i] for value, i in reversed(entries[max(len(entries) - n, 0):])]
+
+    def modified_since(self, stamp):
+        """The tiddlers modified at or after `stamp`, in the order of 
+        modification.
+
+        :param stamp: Integer or prefix of a stamp, e.g. `'20240301'` (see 
+         `stamp_value()`).
+        :return: List of the tiddlers.
+        """
+        if self.sortedindex is None:
+            self.query_index()
+        entries = self.sortedindex['modified']
+        lo = bisect.bisect_left(entries, (stamp_value(stamp),))
+        return [self.tiddlers[i] for value, i in entries[lo:]]
+
+    @timed('recent_tiddler')
+    def recent_tiddler(self, n=20):
+        """Generate a tiddler `Recent figures` linking to the `n` tiddlers 
+        modified last, from the sorted index rather than a filter run by the 
+        browser. The system tiddlers and the generated ones are left out. """
+        title = 'Recent figures'
+        if self.sortedindex is None:
+            self.query_index()
+        links = []
+        for value, i in reversed(self.sortedindex['modified']):
+            td = self.tiddlers[i]
+            if td.title.startswith('$:/') or td.title in ('Tag List', title) \
+                or 'type="text/x-markdown"' not in td.head():
+                continue
+            links.append('* [{}](#{}) {}\n'.format(td.title, 
+                urllib.parse.quote(td.title), stamp_text(td.modified)))
+            if len(links) == n:
+                break
+        modified = self.timestamp()
+        index, created = self.find_tiddler(title)
+        if created == None:
+            created = modified
+        self.tiddler_generate(title, ''.join(links), '', created, modified, 
+            index, 'text/x-markdown')
+
+    def query(self, tags=(), any_tags=(), not_tags=(), title=None, 
+        created=None, modified=None):
+        """Find tiddlers by tags, title and dates.
+
+        :param tags: The tiddlers must have all of these tags (AND).
+        :type tags: list of str
+        :param any_tags: ... and at least one of these (OR).
+        :type any_tags: list of str
+        :param not_tags: ... and none of these (NOT).
+        :type not_tags: list of str
+        :param title: Title prefix (str), or a compiled regular expression 
+         searched in the title.
+        :param tuple created: `(since, until)`, prefixes of the 
+         `YYYYmmddHHMMSSfff` stamps, e.g. `('201803', '201806')`; the end 
+         is excluded and either may be `None`.
+        :param tuple modified: Same as `created`.
+        :return: List of the tiddlers, in the order of `self.tiddlers`.
+        """
+        if self.tagindex is None:
+            self.query_index()
+        found = None
+        def narrow(found, indices):
+            return set(indices) if found is None else found & indices
+        for tag in tags:
+            found = narrow(found, self.tagindex.get(tiddlytag(tag), set()))
+        if any_tags:
+            found = narrow(found, set().union(*[self.tagindex.get(tiddlytag(t), set()) 
+                for t in any_tags]))
+        if created is not None:
+            found = narrow(found, self.select_range('created', *created))
+        if modified is not None:
+            found = narrow(found, self.select_range('modified', *modified))
+        if type(title) == str:
+            found = narrow(found, self.select_range('title', title, 
+                title[:-1] + chr(ord(title[-1]) + 1) if title else None))
+        if found is None:
+            found = set(range(len(self.tiddlers)))
+        for tag in not_tags:
+            found -= self.tagindex.get(tiddlytag(tag), set())
+        result = [self.tiddlers[i] for i in sorted(found)]
+        if title is not None and type(title) != str:
+            result = [td for td in result if title.search(td.title)]
+        return result
 
-    def publish(self, outfile):
-        """Write the tiddly wiki to `outfile`. """
-        with open(outfile, encoding='utf-8', mode='w') as twout:
-            for head_l in self.headerlines:
-                twout.write(head_l)
-            for tid in self.tiddlers:
-                for tid_l in tid.text:
-                    twout.write(tid_l)
-            for trail_l in self.trailerlines:
-                twout.write(trail_l)
+    def blocks(self, tiddlers):
+        """Generator of the blocks of `tiddlers` (see `Tiddler.block()`).
+
+        The embedded images are encoded on their pool ahead of the writer, 
+        whole images at once: the first chunk of each of the next `2 * 
+        cpu_count` image tiddlers to write is started (see 
+        `ImageTiddler.prefetch()`), and one more each time one is written.
+        """
+        images = []
+        if self.imagetiddlers:
+            images = [td for td in tiddlers if td in self.imagetiddlers 
+                and td._text is not None and td.pool is not None]
+        ahead = 2 * (os.cpu_count() or 1)
+        for td in images[:ahead]:
+            td.prefetch()
+        written = 0
+        for td in tiddlers:
+            if written < len(images) and td is images[written]:
+                written += 1
+                if written + ahead - 1 < len(images):
+                    images[written + ahead - 1].prefetch()
+            yield td.block()
+
+    @timed('publish')
+    def publish(self, outfile, bufsize=2**20, fsync=False):
+        """Write the tiddly wiki to `outfile`. 
+
+        The text of consecutive tiddlers is joined and encoded in chunks of 
+        about `bufsize` bytes, and the memory-mapped tiddlers are copied 
+        without decoding. The byte range of each tiddler in `outfile` is kept 
+        in `self.ranges`.
+
+        :param str outfile: Output file.
+        :param int bufsize: Size of the chunks and of the write buffer.
+        :param boolean fsync: Flush `outfile` to the disk before closing it.
+        """
+        self.ranges = []
+        with open(outfile, mode='wb', buffering=bufsize) as twout:
+            pos = twout.write(''.join(self.headerlines).encode('utf-8'))
+            pending, size = [], 0
+            for block in self.blocks(self.tiddlers):
+                if type(block) == str:
+                    pending.append(block)
+                    n = len(block)
+                    if not block.isascii():
+                        n = len(block.encode('utf-8'))
+                    size += n
+                    if size >= bufsize:
+                        twout.write(''.join(pending).encode('utf-8'))
+                        pending, size = [], 0
+                else:
+                    if pending:
+                        twout.write(''.join(pending).encode('utf-8'))
+                        pending, size = [], 0
+                    n = write_block(twout, block)
+                self.ranges.append((pos, pos + n))
+                pos += n
+            pending.extend(self.trailerlines)
+            twout.write(''.join(pending).encode('utf-8'))
+            if fsync:
+                twout.flush()
+                os.fsync(twout.fileno())
+            if self.stats != None:
+                self.stats.count('bytes_written', twout.tell())
+                self.stats.count('tiddlers_written', len(self.tiddlers))
+
+    @timed('append_tiddlers')
+    def append_tiddlers(self, path):
+        """Write the tiddlers added after `read()` into `path` in place, just 
+        before the trailer, instead of rewriting the whole file.
+
+        Only the trailer is rewritten. It is saved to a journal first, see 
+        `recover_journal()`, so that a crash leaves either the old or the new 
+        file. The append is refused, and nothing is written, when a stored 
+        tiddler has been replaced or removed or `path` is not the file that 
+        was read.
+
+        :param str path: The TiddlyWiki file read by `read()`.
+        :return: `True` when the tiddlers are appended.
+        """
+        st = os.stat(path)
+        if self.rewrite or (st.st_size, st.st_mtime_ns) != \
+            (self.filestat.st_size, self.filestat.st_mtime_ns):
+            return False
+        trailer = ''.join(self.trailerlines).encode('utf-8')
+        offset = st.st_size - len(trailer)
+        with open(path, mode='r+b') as twout:
+            twout.seek(max(offset, 0))
+            if offset < 0 or twout.read(len(trailer)) != trailer:
+                return False
+            try:
+                journal = write_journal(path, offset, trailer)
+            except FileExistsError:     # another process is appending
+                return False
+            self.close()    # the mapped file is going to be written
+            twout.seek(offset)
+            ranges = []
+            pos = offset
+            for block in self.blocks(self.tiddlers[self.nstored:]):
+                end = pos + write_block(twout, block)
+                ranges.append((pos, end))
+                pos = end
+            twout.write(trailer)
+            twout.flush()
+            os.fsync(twout.fileno())
+        os.remove(path + '.fpjournal')
+        journal.close()
+
+        if self.stats != None:
+            self.stats.count('bytes_written', pos + len(trailer) - offset)
+            self.stats.count('tiddlers_written', len(ranges))
+        if self.ranges is None:     # read as text: stored ranges unknown
+            self.ranges = [None] * self.nstored
+        self.ranges = self.ranges[:self.nstored] + ranges
+        self.filestat = os.stat(path)
+        self.nstored = len(self.tiddlers)
+        self.remap(path)
+        if self.cache:
+            self.save_index(path)
+        return True
+
+def utcstamp():
+    """The current UTC time as a `YYYYmmddHHMMSSfff` stamp. """
+    return datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")[:-3]
+
+def stamp_value(stamp):
+    """Integer value of a `YYYYmmddHHMMSSfff` stamp, or of a prefix padded 
+    with zeros, e.g. `'201803'` -> `20180300000000000`. Integers are 
+    returned as they are, and `None` for anything else.
+    """
+    if type(stamp) == int:
+        return stamp
+    if type(stamp) == str and stamp.isdigit() and len(stamp) <= 17:
+        return int(stamp.ljust(17, '0'))
+    return None
+
+def stamp_text(stamp):
+    """`'2024-03-01 12:00'` for the stamp `'20240301120000000'`. """
+    return '{}-{}-{} {}:{}'.format(stamp[:4], stamp[4:6], stamp[6:8], 
+        stamp[8:10], stamp[10:12]) if stamp and len(stamp) >= 12 else ''
+
+def index_key(path, size=2**16):
+    """Identify the content of `path` for its sidecar index: the size, the 
+    modification time and a sha1 of the first and the last `size` bytes. 
+    """
+    st = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, mode='rb') as fp:
+        digest.update(fp.read(size))
+        fp.seek(max(st.st_size - size, 0))
+        digest.update(fp.read(size))
+    return [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+
+def write_journal(path, offset, trailer):
+    """Save the trailer of `path` before it is overwritten at `offset`.
+
+    The journal `path + '.fpjournal'` holds a header (magic, offset, length, 
+    crc32) and the trailer bytes, and is synced to the disk before `path` is 
+    touched. It is written under a temporary name and linked in place when 
+    complete, the directory is synced so that the link is on the disk too, 
+    and the journal stays locked until the returned file is closed, so that 
+    `recover_journal()` in another process leaves a running append alone.
+
+    :return: The open journal file.
+    :raises FileExistsError: When the journal already exists.
+    """
+    tmpname = '{}.fpjournal.{}'.format(path, uuid.uuid4().hex)
+    journal = open(tmpname, mode='wb')
+    try:
+        if fcntl != None:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX)
+        journal.write(struct.pack('<4sQQI', b'FPJ1', offset, len(trailer), 
+            zlib.crc32(trailer)))
+        journal.write(trailer)
+        journal.flush()
+        os.fsync(journal.fileno())
+        os.link(tmpname, path + '.fpjournal')
+    except BaseException:
+        journal.close()
+        raise
+    finally:
+        os.remove(tmpname)
+    try:
+        fsync_directory(os.path.dirname(os.path.abspath(path)))
+    except BaseException:
+        journal.close()
+        os.remove(path + '.fpjournal')
+        raise
+    return journal
+
+def fsync_directory(directory):
+    """Flush the entries of `directory` to the disk, so that a file just 
+    linked or renamed there survives a power loss. Not needed, and not 
+    possible, on Windows. """
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def recover_journal(path):
+    """Undo an interrupted `TiddlyWikiParse.append_tiddlers()`.
+
+    When a complete journal is found, the trailer is written back at its 
+    offset and the file is truncated after it, removing any partly appended 
+    tiddler. An incomplete journal means `path` was not touched yet; it is 
+    just removed.
+
+    :param str path: TiddlyWiki file.
+    :return: `True` when `path` was restored.
+    """
+    jpath = path + '.fpjournal'
+    try:
+        journal = open(jpath, mode='rb')
+    except FileNotFoundError:
+        return False
+    with journal:
+        if fcntl != None:
+            try:
+                fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:     # the append is still running
+                return False
+            try:
+                if not os.path.samestat(os.stat(jpath), os.fstat(journal.fileno())):
+                    return False
+            except FileNotFoundError:   # the append has just finished
+                return False
+        head = journal.read(struct.calcsize('<4sQQI'))
+        trailer = journal.read()
+        restored = False
+        if len(head) == struct.calcsize('<4sQQI'):
+            magic, offset, length, crc = struct.unpack('<4sQQI', head)
+            if magic == b'FPJ1' and length == len(trailer) and crc == zlib.crc32(trailer):
+                with open(path, mode='r+b') as twout:
+                    twout.seek(offset)
+                    twout.write(trailer)
+                    twout.truncate()
+                    twout.flush()
+                    os.fsync(twout.fileno())
+                print("recovered: ", path)
+                restored = True
+        try:
+            os.remove(jpath)
+        except FileNotFoundError:
+            pass
+    return restored
 
 def tiddlytag(tg):
     """Format the tags for tiddlywiki5;   
@@ -237,20 +1398,25 @@ def tiddlytag(tg):
     else:
         return tg
 
-def markdown_ptext(image, description):
+def markdown_ptext(image, description, thumb=None):
     """Generate the tiddler text conbining the image and description.
 
     :param image: The path to the imagefile.
     :type image: list or str    
     :param description str: Text part of the tiddler.  
+    :param thumb: The path to the thumbnail of each image. When given, the 
+     thumbnails are shown as links to the images.
+    :type thumb: list or str    
     :return: The tiddler text.
     """    
-    if type(image) == list:
+    if type(image) != list:
+        image = [image]
+        thumb = None if thumb == None else [thumb]
+    if thumb == None:
         ptxt = [markdownimage(im) for im in image]
-        ptxt = ''.join(ptxt) + description
-    else:   
-        ptxt = markdownimage(image) + description
-    return ptxt
+    else:
+        ptxt = [markdownthumb(th, im) for th, im in zip(thumb, image)]
+    return ''.join(ptxt) + description
 
 def markdownimage(img, width=1000):
     """Format the image embedding using the markdown notation.
@@ -261,36 +1427,537 @@ def markdownimage(img, width=1000):
     """
     return '![image](' + img + '){:width="' + str(width) + '"}\n'
 
+def markdownthumb(thumb, img):
+    """Format a thumbnail linking to the full image using the markdown notation.
+
+    :param str thumb: Relative path to the thumbnail.
+    :param str img: Relative path to the image.
+    :return: Markdown string.
+    """
+    return '[![image](' + thumb + ')](' + img + ')\n'
+
+def file_digest(path, blocksize=2**20):
+    """The sha1 hex digest of the content of `path`, read in blocks. """
+    digest = hashlib.sha1()
+    with open(path, mode='rb') as fp:
+        block = fp.read(blocksize)
+        while block:
+            digest.update(block)
+            block = fp.read(blocksize)
+    return digest.hexdigest()
+
+class HashIndex(object):
+    """Content hashes of image files, cached by path, size and mtime, and the 
+    first path seen for each content (the canonical copy).
+
+    Kept as JSON in a sidecar file next to the wiki, `wiki + '.fphash'`.
+    """
+    def __init__(self, path):
+        """Constructor. Loads `path` when it exists.
+
+        :param str path: The index file.
+        """
+        self.path = path
+        self.files = {}         # abspath -> [size, mtime_ns, sha1]
+        self.canonical = {}     # sha1 -> abspath
+        self.saved = 0
+        self.duplicates = 0
+        try:
+            with open(path, encoding='utf-8') as fp:
+                index = json.load(fp)
+            self.files, self.canonical = index['files'], index['canonical']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def digests(self, paths):
+        """The sha1 of each file. Only the files that are new, or whose size or 
+        mtime changed, are read, in a thread pool.
+
+        :param list paths: Paths to the files.
+        :return: List of hex digests.
+        """
+        paths = [os.path.abspath(p) for p in paths]
+        stats = [os.stat(p) for p in paths]
+        todo = []
+        for p, st in zip(paths, stats):
+            entry = self.files.get(p)
+            if entry == None or entry[:2] != [st.st_size, st.st_mtime_ns]:
+                todo.append(p)
+        if todo:
+            with concurrent.futures.ThreadPoolExecutor() as hasher:
+                for p, d in zip(todo, hasher.map(file_digest, todo)):
+                    st = os.stat(p)
+                    self.files[p] = [st.st_size, st.st_mtime_ns, d]
+        return [self.files[p][2] for p in paths]
+
+    def dedup(self, paths):
+        """Replace each file by the canonical copy of its content. A file 
+        becomes canonical when its content is new, or the former canonical 
+        copy is gone or changed. `self.saved` adds up the bytes of the 
+        duplicates.
+
+        :param list paths: Paths to the files.
+        :return: List of paths, absolute.
+        """
+        result = []
+        for p, d in zip([os.path.abspath(p) for p in paths], self.digests(paths)):
+            c = self.canonical.get(d)
+            if c != None and c != p:
+                try:
+                    if self.digests([c])[0] == d:
+                        self.saved += self.files[p][0]
+                        self.duplicates += 1
+                        result.append(c)
+                        continue
+                except FileNotFoundError:
+                    self.files.pop(c, None)
+            self.canonical[d] = p
+            result.append(p)
+        return result
+
+    def save(self):
+        """Write the index file. """
+        tmpfile = self.path + '.tmp'
+        with open(tmpfile, encoding='utf-8', mode='w') as fp:
+            json.dump(dict(files=self.files, canonical=self.canonical), fp, 
+                separators=(',', ':'))
+        os.replace(tmpfile, self.path)
+
+def make_thumbnail(image, thumb, size):
+    """Write a thumbnail of `image`, at most `size` pixels wide and high, to 
+    the PNG file `thumb`. Run in the worker processes of `thumbnails()`.
+    """
+    tmpfile = '{}.{}.tmp'.format(thumb, uuid.uuid4().hex)
+    with Image.open(image) as im:
+        im.thumbnail((size, size))
+        im.save(tmpfile, format='PNG')
+    os.replace(tmpfile, thumb)
+    return thumb
+
+def thumbnails(images, thumbdir, size=400, pool=None, hashes=None):
+    """Make the thumbnails of the images in `thumbdir`. 
 
-def relative_path_to_image(outfile, image):
-    """Convert image file path relative to the html file (Wrapper). """ 
-    opath = os.path.normpath(outfile)
-    if type(image) == list:
-        image = [trim_path_to_image(opath, im) for im in image]
-    else:   
-        image = trim_path_to_image(opath, image)
-    return image
+    The thumbnails are named after the sha1 of the image content and `size`, 
+    so an image already thumbnailed, under any name, is skipped. The images 
+    are hashed in threads and the missing thumbnails are made in `pool` or 
+    in a new process pool. Requires Pillow.
 
-def trim_path_to_image(outfile, impath):
+    :param list images: Paths to the images.
+    :param str thumbdir: Directory for the thumbnails.
+    :param int size: Maximum width and height of the thumbnails in pixels.
+    :param pool: Process pool to make the thumbnails.
+    :type pool: concurrent.futures.Executor
+    :param HashIndex hashes: Cached hashes, so that only the new or changed 
+     images are read.
+    :return: List of the paths to the thumbnails, or `None` without Pillow.
+    """
+    if Image == None:
+        print("Thumbnails require Pillow; the images are linked as they are.")
+        return None
+    os.makedirs(thumbdir, exist_ok=True)
+    if hashes != None:
+        digests = hashes.digests(images)
+    else:
+        with concurrent.futures.ThreadPoolExecutor() as hasher:
+            digests = list(hasher.map(file_digest, images))
+    thumbs = [os.path.join(thumbdir, '{}-{}.png'.format(d, size)) for d in digests]
+    todo = {}
+    for im, th in zip(images, thumbs):
+        if th not in todo and not os.path.exists(th):
+            todo[th] = im
+    if len(todo) == 1 and pool == None:
+        for th, im in todo.items():
+            make_thumbnail(im, th, size)
+    elif todo:
+        if pool == None:
+            with concurrent.futures.ProcessPoolExecutor() as pool:
+                list(pool.map(make_thumbnail, todo.values(), todo.keys(), 
+                    [size] * len(todo)))
+        else:
+            list(pool.map(make_thumbnail, todo.values(), todo.keys(), 
+                [size] * len(todo)))
+    return thumbs
+
+
+class PathResolver(object):
+    """Relative paths from the directory of a wiki to many image files.
+
+    The directory of the wiki is normalized once, and the relative path of 
+    each image directory is computed once and remembered, so a list of 
+    images in a few directories costs a dictionary lookup per image::
+
+        paths = PathResolver('site/tw5md_figs.html')
+        paths.relative('figs/run1/fig1.png')    # '../figs/run1/fig1.png'
+
+    With `flavor=os.path` (the default), relative and absolute paths can be 
+    mixed; they are resolved against the current directory. With 
+    `flavor=ntpath` or `flavor=posixpath`, paths of that platform are 
+    compared as they are, e.g. Windows paths on Linux.
+    """
+    def __init__(self, outfile, flavor=os.path):
+        """Constructor
+
+        :param str outfile: Path to the wiki.
+        :param flavor: `os.path`, `ntpath` or `posixpath`.
+        :type flavor: module
+        """
+        self.flavor = flavor
+        self.resolve = flavor is os.path
+        drive, parts = self.split(flavor.dirname(self.normpath(outfile)))
+        self.odrive = flavor.normcase(drive)
+        self.oparts = [flavor.normcase(p) for p in parts]
+        self.dirs = {}
+
+    def normpath(self, path):
+        """Absolute path with `os.path`, normalized path otherwise. """
+        if self.resolve:
+            return self.flavor.abspath(path)
+        return self.flavor.normpath(path)
+
+    def split(self, path):
+        """Split a normalized path into the drive and the list of its 
+        components; the root of an absolute path is kept as the first one.
+        """
+        flavor = self.flavor
+        drive, path = flavor.splitdrive(path)
+        parts = [p for p in path.split(flavor.sep) if p and p != flavor.curdir]
+        if flavor.isabs(path):
+            parts.insert(0, flavor.sep)
+        return drive, parts
+
+    def relative_dir(self, directory):
+        """Relative path from the wiki to `directory`, '' for the same one. """
+        flavor = self.flavor
+        path = self.normpath(directory if directory else flavor.curdir)
+        drive, parts = self.split(path)
+        oparts = self.oparts
+        if flavor.normcase(drive) != self.odrive \
+            or (parts[:1] == [flavor.sep]) != (oparts[:1] == [flavor.sep]):
+            return path     # no relative path across drives
+        n = min(len(oparts), len(parts))
+        i = 0
+        while i < n and oparts[i] == flavor.normcase(parts[i]):
+            i += 1
+        rel = [flavor.pardir] * (len(oparts) - i) + parts[i:]
+        return flavor.join(*rel) if rel else ''
+
+    def relative(self, impath):
+        """Relative path from the wiki to `impath`. """
+        directory, name = self.flavor.split(impath)
+        reldir = self.dirs.get(directory)
+        if reldir == None:
+            reldir = self.relative_dir(directory)
+            self.dirs[directory] = reldir
+        return self.flavor.join(reldir, name) if reldir else name
+
+    def __call__(self, image):
+        """Relative path(s) of an image or a list of images. """
+        if type(image) == list:
+            return [self.relative(im) for im in image]
+        return self.relative(image)
+
+def relative_path_to_image(outfile, image, flavor=os.path):
+    """Convert image file path relative to the html file (Wrapper). 
+
+    :param str outfile: Path to the output file.
+    :param image: Path(s) to the image file(s).
+    :type image: list or str
+    :param flavor: `os.path`, `ntpath` or `posixpath` (see `PathResolver`).
+    :type flavor: module
+    :return: Relative path(s) from `outfile` to `image`.
+    """ 
+    return PathResolver(outfile, flavor)(image)
+
+def trim_path_to_image(outfile, impath, flavor=os.path):
     """Convert image file path relative to the html file.
 
     :param str outfile: Path to the output file.
     :param str impath: Path to the image file.
+    :param flavor: `os.path`, `ntpath` or `posixpath` (see `PathResolver`).
+    :type flavor: module
     :return: Relative path from `outfile` to `impath`. 
     """
-    opath_ele = os.path.normpath(outfile).split('\\')
-    im_ele = os.path.normpath(impath).split('\\')
-    olen, ilen = len(opath_ele), len(im_ele)
-    for i in range(min(olen, ilen)):
-            if im_ele[i] != opath_ele[i]:
-                break
-    r_impath = os.path.join( "..\\" * (olen - 1 - i), 
-            *im_ele[i:])            
-    return os.path.normpath(r_impath)
+    return PathResolver(outfile, flavor).relative(impath)
+
+def tag_section(tag):
+    """The escaped section of `tag` in `Tag List`. """
+    if tag.startswith("[[") and tag.endswith("]]"):
+        tag = tag[2:-2]
+    return html.escape('!!! {0}\n<<list-links "[tag[{0}]]">>\n'.format(tag))
+
+def tag_letter(tag):
+    """The sub-tiddler of `Tag List` holding `tag`: its first letter in 
+    upper case, or '#' for the tags starting with a digit or a sign. """
+    letter = tag.lstrip('[')[:1].upper()
+    return letter if letter.isalpha() else '#'
+
+def tiddlytags(tags):
+    """Split and format the tags given to `addtiddler()`.
+
+    :param tags: Comma delimited string `"red, blue triangle"` or a list 
+     `["red", "blue triangle"]`.
+    :type tags: list or str
+    :return: List of the tags decorated by `tiddlytag()`.
+    """
+    if type(tags) != list:
+        tags = tags.split(',')
+    return [tiddlytag(t.strip()) for t in tags]
+
+class PortfolioSession(object):
+    """Add many tiddlers to a TiddlyWiki file with one read and one write.
+
+    The file is read when the session is opened. `add()` only changes the 
+    tiddlers in memory, and `publish()` regenerates the `Tag List` tiddler 
+    when needed and writes the file once. Used as a context manager, the 
+    session publishes when the `with` block exits without an exception::
+
+        with PortfolioSession('tw5md_figs.html') as ps:
+            ps.add('Figs 1-2', image=['fig1.png', 'fig2.png'], tags='tomato')
+            ps.add('Figs 3-4', image=['fig3.png', 'fig4.png'], tags='potato')
+    """
+    def __init__(self, infile, outfile=None, lazy=False, cache=False, 
+        thumbnails=None, thumbsize=400, dedup=False, embed=False, recent=0, 
+        split_taglist=False, stats=None):
+        """Constructor
+
+        :param str infile: TiddlyWiki file.
+        :param str outfile: Output file. When it is `None`, overwrites the input file.
+        :param boolean lazy: Memory-map the wiki instead of reading the text 
+         of every tiddler (see `TiddlyWikiParse`).
+        :param boolean cache: Use and update the sidecar index `infile + 
+         '.fpidx'` (see `TiddlyWikiParse`).
+        :param str thumbnails: Directory for the thumbnails of the images. 
+         When given, the tiddlers show thumbnails linking to the images 
+         (see `thumbnails()`).
+        :param int thumbsize: Maximum width and height of the thumbnails.
+        :param boolean dedup: Link the first copy of byte-identical images 
+         instead of the duplicates (see `HashIndex`).
+        :param boolean embed: Store the images in the wiki as image tiddlers 
+         titled by their relative path (see `ImageTiddler`), instead of 
+         linking the files.
+        :param int recent: Keep a `Recent figures` tiddler listing the 
+         `recent` tiddlers modified last (see 
+         `TiddlyWikiParse.recent_tiddler()`); 0 for none.
+        :param boolean split_taglist: Split `Tag List` into one tiddler per 
+         first letter (see `TiddlyWikiParse.taglist_tiddler()`).
+        :param Stats stats: Record the phases of the session (see 
+         `instrument()`).
+        """
+        self.infile = infile
+        self.outfile = outfile
+        self.thumbnails = thumbnails
+        self.thumbsize = thumbsize
+        self.dedup = dedup
+        self.embed = embed
+        self.recent = recent
+        self.split_taglist = split_taglist
+        self.paths = PathResolver(infile if outfile == None else outfile)
+        self.pool = None
+        self.hashes = None
+        if dedup or thumbnails != None:
+            self.hashes = HashIndex(infile + '.fphash')
+        self.stats = stats or None
+        self.tw = TiddlyWikiParse(infile, lazy=lazy, cache=cache)
+        self.tw.stats = self.stats
+        self.tw.read()
+        if self.stats != None:
+            self.stats.count('tiddlers_read', self.tw.nstored)
+        self.tagversion = self.tw.tagversion
+        self.added = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.publish()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        """Release the wiki and the thumbnail workers. """
+        self.tw.close()
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def add(self, title, image=None, description='', tags='', replace=True, 
+        per_tiddler=None, remove=False):
+        """Add a new tiddler in memory. The parameters are the same as 
+        `addtiddler()`.
+
+        :param int per_tiddler: Split a list of more images than that into 
+         pages, see `add_pages()`.
+        :param boolean remove: Remove the tiddler `title` instead; the other 
+         parameters are ignored.
+        :return: `True` when the tiddler is added (or removed), or the number 
+         of the tiddlers added with the pages.
+        """
+        if remove:
+            if self.tw.remove_tiddler(title) == None:
+                return False
+            self.added += 1     # so that publish() writes the wiki
+            return True
+        if (image == None) and (description == '' or description == None):
+            print("addtiddler() requires at least `image` or `description`.")
+            return False
+        if self.tw.batchstamp is None:  # one stamp until publish()
+            self.tw.batchstamp = utcstamp()
+        if per_tiddler != None and type(image) == list and len(image) > per_tiddler:
+            return self.add_pages(title, image, per_tiddler, description, tags, 
+                replace)
+        if image == None:
+            ptxt = description
+        else:
+            images = image if type(image) == list else [image]
+            if self.dedup:
+                images = self.hashes.dedup(images)
+                image = images if type(image) == list else images[0]
+            thumb = None
+            if self.thumbnails != None:
+                if self.pool == None and Image != None:
+                    self.pool = concurrent.futures.ProcessPoolExecutor()
+                thumb = thumbnails(images, self.thumbnails, self.thumbsize, 
+                    self.pool, self.hashes)
+                if thumb != None and type(image) != list:
+                    thumb = thumb[0]
+            if self.embed:
+                image = self.embed_images(image)
+                if thumb != None:
+                    thumb = self.embed_images(thumb)
+                    # internal links to the full images
+                    image = ['#' + urllib.parse.quote(t) for t in image] \
+                        if type(image) == list else '#' + urllib.parse.quote(image)
+            else:
+                image = self.paths(image)
+                if thumb != None:
+                    thumb = self.paths(thumb)
+            ptxt = markdown_ptext(image, description, thumb)
+
+        self.tw.new_tiddler(title, ptxt, tiddlytags(tags), replace)
+        self.added += 1
+        if self.stats != None:
+            self.stats.count('tiddlers_added')
+        return True
+
+    def add_pages(self, title, images, per_tiddler, description='', tags='', 
+        replace=True):
+        """Add `images` as the pages of the index `title` (see 
+        `page_tiddlers()`). When `title` exists and `replace` is `False`, the 
+        index takes the next free title 'title-01'... first, and the pages 
+        are named after it, so that the old index keeps its own pages.
+
+        :return: Number of the tiddlers added.
+        """
+        if not replace and self.tw.find_tiddler(title)[0] is not None:
+            free = self.tw.free_title(title)
+            if free == None:
+                free = title + '-99'
+                msg = "Warning: Overwriting the 100 th tiddler '{}' "
+                print(msg.format(free))
+            title = free
+        added = 0
+        for spec in page_tiddlers(title, images, per_tiddler, description, tags):
+            if self.add(**spec):
+                added += 1
+        return added
+
+    def embed_images(self, image):
+        """Add the image tiddlers of `image`. 
+
+        :param image: Path(s) to the image file(s).
+        :type image: list or str
+        :return: Title(s) of the image tiddlers.
+        """
+        if self.pool == None:
+            self.pool = concurrent.futures.ProcessPoolExecutor()
+        titles = self.paths(image)
+        for path, title in zip(image if type(image) == list else [image], 
+            titles if type(titles) == list else [titles]):
+            self.tw.new_image_tiddler(title.replace(os.sep, '/'), path, self.pool)
+        if type(titles) == list:
+            return [t.replace(os.sep, '/') for t in titles]
+        return titles.replace(os.sep, '/')
+
+    def publish(self):
+        """Regenerate `Tag List` if the tags changed, and `Recent figures`, 
+        and write the file. Nothing is written when no tiddler has been 
+        added. The tiddlers added since the last `publish()` share their 
+        created/modified stamp.
+        """
+        if self.added == 0:
+            self.tw.batchstamp = None
+            return None
+        if self.tw.tagversion != self.tagversion:
+            self.tw.tags()
+            self.tw.taglist_tiddler(self.split_taglist)
+            self.tagversion = self.tw.tagversion
+        if self.recent:
+            self.tw.recent_tiddler(self.recent)
+        self.tw.batchstamp = None
+
+        outfile = self.outfile
+        if outfile != None and os.path.exists(outfile) \
+            and os.path.samefile(outfile, self.infile):
+            outfile = None   # the mapped input must not be truncated
+        if outfile == None and self.tw.append_tiddlers(self.infile):
+            print("appended: ", self.infile)
+            self.save_hashes()
+            self.added = 0
+            return None
+        target = self.infile if outfile == None else outfile
+        mapped = self.tw.mapping is not None and os.path.exists(target) \
+            and os.path.samefile(target, self.tw.mapfile.name)
+        if outfile == None or mapped:
+            # the mapped file must not be truncated; next to the target, so 
+            # that os.replace() is an atomic rename
+            fd, tmpfile = tempfile.mkstemp(suffix='.tmp', 
+                prefix=os.path.basename(target) + '.', 
+                dir=os.path.dirname(os.path.abspath(target)))
+            os.close(fd)
+        else:
+            tmpfile = target
+        try:
+            self.tw.publish(tmpfile, fsync=tmpfile != target)
+        except BaseException:
+            if tmpfile != target:
+                os.remove(tmpfile)
+            raise
+        print("published: ", tmpfile)
+        self.tw.close()
+        if tmpfile != target:
+            if self.stats != None:
+                started = self.stats.begin()
+            shutil.copymode(target, tmpfile)
+            os.replace(tmpfile, target) 
+            if self.stats != None:
+                self.stats.end('move', started)
+        if outfile == None:
+            self.tw.filestat = os.stat(self.infile)
+            self.tw.stored()
+        self.tw.remap(target)
+        if self.tw.cache:
+            self.tw.save_index(target)
+        self.save_hashes()
+        self.added = 0
+
+    def save_hashes(self):
+        """Write the hash index and report the duplicates. """
+        if self.hashes == None:
+            return
+        if self.hashes.duplicates > 0:
+            print("dedup: {} duplicate images, {} bytes saved".format(
+                self.hashes.duplicates, self.hashes.saved))
+            self.hashes.duplicates = self.hashes.saved = 0
+        self.hashes.save()
 
 #%%    
 def addtiddler(infile, title, outfile=None, image=None, description='', 
-    tags='', replace=True):
+    tags='', replace=True, lazy=False, cache=False, lock=False, 
+    thumbnails=None, thumbsize=400, dedup=False, embed=False, shard=None, 
+    recent=0, split_taglist=False, stats=None, profile=None):
     """Add a new tiddler to a TiddlyWiki file.
 
     :param str infile: TiddlyWiki file.
@@ -307,49 +1974,769 @@ def addtiddler(infile, title, outfile=None, image=None, description='',
     :type tags: list or str
     :param boolean replace: Replace an existing tiddler with the same title (True)
      or rename the new one as 'title-1'(maximum 'title-99').
+    :param boolean lazy: Memory-map the wiki instead of reading the text of 
+     every tiddler. Use it for very large wikis.
+    :param boolean cache: Keep the metadata of the tiddlers in the sidecar 
+     file `infile + '.fpidx'` so that the next call does not parse the wiki.
+    :param boolean lock: Let several processes add tiddlers to the same wiki 
+     (see `queue_tiddlers()`). The input file is overwritten. 
+    :param str thumbnails: Directory for thumbnails of the images. When given, 
+     the tiddler shows thumbnails linking to the full images (requires Pillow).
+    :param int thumbsize: Maximum width and height of the thumbnails in pixels.
+    :param boolean dedup: Link byte-identical images to the first copy seen. 
+     The content hashes are cached in the sidecar file `infile + '.fphash'`, 
+     so only new or changed images are read.
+    :param boolean embed: Store the images in the wiki as base64 image 
+     tiddlers shown by the new tiddler, so that the wiki does not depend on 
+     the image files. 
+    :param str shard: `'tag'`, `'date'` or `'hash'`. `infile` is the index 
+     of a portfolio split into several wikis, and the tiddler is added to 
+     the shard chosen by its first tag, the month, or a hash of the title 
+     (see `shard_tiddlers()`). `outfile` cannot be used.
+    :param int recent: Keep a `Recent figures` tiddler linking to the 
+     `recent` tiddlers modified last; 0 for none.
+    :param boolean split_taglist: Split `Tag List` into `Tag List/A`, 
+     `Tag List/B`..., so that the browser renders one short list at a time.
+    :param stats: Record the wall time, bytes, tiddler counts and peak 
+     memory of each phase of the call: `True` prints them as one JSON line, 
+     a path appends the line to that file, and a `Stats` collects them. 
+     Taken from the environment variable `FIGURE_PORTFOLIO_STATS` when 
+     `None` (see `instrument()`).
+    :param str profile: Write a `cProfile` dump of the call to this path, or 
+     to `FIGURE_PORTFOLIO_PROFILE` when `None`.
     """
     # infile = "tests\\tw5md_mock.html"
-    tw = TiddlyWikiParse(infile)
+    with instrument('addtiddler', stats, profile, infile=infile) as stats:
+        options = dict(lazy=lazy, cache=cache, thumbnails=thumbnails, 
+            thumbsize=thumbsize, dedup=dedup, embed=embed, recent=recent, 
+            split_taglist=split_taglist, stats=stats or False)
+        if shard != None:
+            if outfile != None:
+                print("Sharding adds the tiddlers to the shards of `infile`; `outfile` cannot be used.")
+                return None
+            spec = dict(title=title, image=image, description=description, 
+                tags=tags, replace=replace)
+            return shard_tiddlers(infile, [spec], shard, lock=lock, 
+                profile=False, **options)
+        if lock:
+            spec = dict(title=title, image=image, description=description, 
+                tags=tags, replace=replace)
+            return queue_tiddlers(infile, [spec], outfile, **options)
+        with PortfolioSession(infile, outfile, **options) as ps:
+            ps.add(title, image, description, tags, replace)
+
+def addtiddlers(infile, tiddlers, outfile=None, lazy=False, cache=False, 
+    lock=False, thumbnails=None, thumbsize=400, dedup=False, embed=False, 
+    shard=None, recent=0, split_taglist=False, stats=None, profile=None):
+    """Add many tiddlers to a TiddlyWiki file in a single read/publish pass.
+
+    :param str infile: TiddlyWiki file.
+    :param tiddlers: Tiddler specs. Each one is a dict with the keys `title`, 
+     `image`, `description`, `tags` and `replace`, same as the parameters of 
+     `addtiddler()`, `per_tiddler` (see `PortfolioSession.add_pages()`) and 
+     `remove` (see `PortfolioSession.add()`). Only `title` is required.
+    :type tiddlers: list of dict
+    :param str outfile: Output file. When it is `None`, overwrites the input file.
+    :param boolean lazy: Memory-map the wiki (see `addtiddler()`).
+    :param boolean cache: Use the sidecar index (see `addtiddler()`).
+    :param boolean lock: Let several processes add tiddlers to the same wiki 
+     (see `queue_tiddlers()`).
+    :param str thumbnails: Directory for thumbnails (see `addtiddler()`).
+    :param int thumbsize: Size of the thumbnails (see `addtiddler()`).
+    :param boolean dedup: Link duplicate images once (see `addtiddler()`).
+    :param boolean embed: Embed the images (see `addtiddler()`).
+    :param str shard: Add to the shards of the index `infile` (see 
+     `addtiddler()`).
+    :param int recent: Size of `Recent figures` (see `addtiddler()`).
+    :param boolean split_taglist: Split `Tag List` (see `addtiddler()`).
+    :param stats: Record the phases of the call (see `addtiddler()`).
+    :param str profile: Path of a `cProfile` dump (see `addtiddler()`).
+    :return: Number of the tiddlers added.
+    """
+    with instrument('addtiddlers', stats, profile, infile=infile) as stats:
+        options = dict(lazy=lazy, cache=cache, thumbnails=thumbnails, 
+            thumbsize=thumbsize, dedup=dedup, embed=embed, recent=recent, 
+            split_taglist=split_taglist, stats=stats or False)
+        if shard != None:
+            if outfile != None:
+                print("Sharding adds the tiddlers to the shards of `infile`; `outfile` cannot be used.")
+                return None
+            return shard_tiddlers(infile, tiddlers, shard, lock=lock, 
+                profile=False, **options)
+        if lock:
+            return queue_tiddlers(infile, tiddlers, outfile, **options)
+        with PortfolioSession(infile, outfile, **options) as ps:
+            added = 0
+            for spec in tiddlers:
+                added += ps.add(**spec)
+        return added
+
+def shard_key(spec, by, nshards=16):
+    """Name of the shard receiving a tiddler.
+
+    :param dict spec: Tiddler spec, see `addtiddlers()`.
+    :param str by: `'tag'` for the first tag ('untagged' without tags), 
+     `'date'` for the current month, `'hash'` for a crc32 of the title 
+     modulo `nshards`.
+    :param int nshards: Number of shards with `by='hash'`.
+    :return: The name, usable in a file name.
+    """
+    if by == 'tag':
+        tags = spec.get('tags') or ''
+        if type(tags) != list:
+            tags = tags.split(',')
+        tags = [t.strip() for t in tags if t.strip()]
+        key = tags[0] if tags else 'untagged'
+    elif by == 'date':
+        key = datetime.datetime.utcnow().strftime('%Y-%m')
+    elif by == 'hash':
+        key = '{:02x}'.format(zlib.crc32(spec['title'].encode('utf-8')) % nshards)
+    else:
+        raise ValueError("shard must be 'tag', 'date' or 'hash', not {!r}".format(by))
+    return re.sub(r'[^\w-]+', '_', key)
+
+def shard_path(index, key):
+    """Path of the shard `key` of the index wiki `index`: `figs.html` has 
+    the shards `figs.<key>.html`. """
+    root, ext = os.path.splitext(index)
+    return '{}.{}{}'.format(root, key, ext)
+
+def create_shard(index, path):
+    """Create the empty wiki `path` with the header, the system tiddlers 
+    (`$:/...`) and the trailer of `index`. 
+
+    :return: `False` when `path` already exists.
+    """
+    tw = TiddlyWikiParse(index)
     tw.read()
+    tw.tiddlers = [td for td in tw.tiddlers if td.title.startswith('$:/')]
+    fd, tmpfile = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.', 
+        dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        tw.publish(tmpfile, fsync=True)
+        shutil.copymode(index, tmpfile)
+        os.link(tmpfile, path)  # fails if another process created it
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmpfile)
 
-    if image == None:
-        if description == '' or description == None:
-            print("addtiddler() requires at least `image` or `description`.")
+def shard_tiddlers(index, tiddlers, by='tag', nshards=16, **options):
+    """Add tiddlers to a portfolio split into several wikis.
+
+    The tiddlers go to the shards `figs.<key>.html` next to the index wiki 
+    `figs.html` (see `shard_key()`), so that each write reads and writes 
+    only the shards receiving tiddlers. A missing shard is created from the 
+    template of the index (see `create_shard()`) and linked from the 
+    `Shards` tiddler of the index, which is only written then. A tiddler is 
+    replaced within its shard: with `by='date'`, the new version of an older 
+    tiddler goes to the shard of the current month.
+
+    :param str index: The index wiki. Its header and trailer are the 
+     template of the shards.
+    :param tiddlers: Tiddler specs, see `addtiddlers()`.
+    :type tiddlers: list of dict
+    :param str by: `'tag'`, `'date'` or `'hash'`, see `shard_key()`.
+    :param int nshards: Number of shards with `by='hash'`.
+    :param options: Other keyword arguments of `addtiddlers()`.
+    :return: Number of the tiddlers added.
+    """
+    shards = {}
+    for spec in tiddlers:
+        shards.setdefault(shard_key(spec, by, nshards), []).append(spec)
+    created = False
+    added = 0
+    for key in sorted(shards, key=natural_key):
+        path = shard_path(index, key)
+        if not os.path.exists(path):
+            created = create_shard(index, path) or created
+        added += addtiddlers(path, shards[key], **options) or 0
+    if created:
+        root, ext = os.path.splitext(index)
+        links = []
+        for name in sorted(glob.glob(glob.escape(root) + '.*' + ext), key=natural_key):
+            name = os.path.basename(name)
+            key = name[len(os.path.basename(root)) + 1:-len(ext)]
+            links.append('* [{}]({})\n'.format(key, urllib.parse.quote(name)))
+        addtiddlers(index, [dict(title='Shards', description=''.join(links))], 
+            **options)
+    return added
+
+def natural_key(path):
+    """Sort key that orders the numbers in `path` by value, so that 
+    `temp_2.png` comes before `temp_10.png`.
+    """
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', path)]
+
+def expand_images(pattern):
+    """Image files matching a glob pattern, in natural order (see 
+    `natural_key()`). The directories are scanned with `glob.iglob()`, 
+    without an intermediate list.
+
+    :param str pattern: Glob pattern, e.g. `"runs/*/temp_*.png"`.
+    :return: List of the paths.
+    """
+    return sorted(glob.iglob(pattern), key=natural_key)
+
+def page_tiddlers(title, images, per_tiddler=None, description='', tags=''):
+    """Tiddler specs showing `images`, at most `per_tiddler` per tiddler.
+
+    With more images than that, the pages are titled `title-01`, `title-02`, 
+    ... and the tiddler `title` is an index linking to the pages.
+
+    :param str title: The title of the tiddler, or of the index.
+    :param list images: Paths to the images.
+    :param int per_tiddler: Maximum number of images in a tiddler; `None` 
+     for no limit.
+    :param str description: Text of the tiddler, or of the index.
+    :param tags: Tags of every tiddler (see `addtiddler()`).
+    :return: List of specs for `addtiddlers()`.
+    """
+    if per_tiddler == None or len(images) <= per_tiddler:
+        return [dict(title=title, image=images, description=description, tags=tags)]
+    npages = (len(images) - 1) // per_tiddler + 1
+    width = max(2, len(str(npages)))
+    specs, links = [], []
+    for i in range(npages):
+        page = images[i * per_tiddler:(i + 1) * per_tiddler]
+        ptitle = '{}-{:0{}d}'.format(title, i + 1, width)
+        specs.append(dict(title=ptitle, image=page, tags=tags))
+        links.append('* [{}](#{}) {} ... {}\n'.format(ptitle, 
+            urllib.parse.quote(ptitle), os.path.basename(page[0]), 
+            os.path.basename(page[-1])))
+    index = ''.join(links) + ('\n' + description if description else '')
+    specs.append(dict(title=title, description=index, tags=tags))
+    return specs
+
+def addimages(infile, title, pattern, outfile=None, per_tiddler=None, 
+    description='', tags='', replace=True, **options):
+    """Add the images matching a glob pattern, in one read/publish pass.
+
+    :param str infile: TiddlyWiki file.
+    :param str title: The title of the new tiddler (see `page_tiddlers()`).
+    :param str pattern: Glob pattern of the images (see `expand_images()`).
+    :param str outfile: Output file. When it is `None`, overwrites the input file.
+    :param int per_tiddler: Maximum number of images in a tiddler. 
+    :param str description: Text of the tiddler, or of the index.
+    :param tags: Tags of the new tiddlers (see `addtiddler()`).
+    :param boolean replace: See `addtiddler()`.
+    :param options: Other keyword arguments of `addtiddlers()`.
+    :return: Number of the tiddlers added.
+    """
+    images = expand_images(pattern)
+    if not images:
+        print("No image matches ", pattern)
+        return 0
+    # paged in the session, where the free titles are known
+    spec = dict(title=title, image=images, description=description, tags=tags, 
+        replace=replace, per_tiddler=per_tiddler)
+    return addtiddlers(infile, [spec], outfile, **options)
+
+def scan_images(directory, pattern='*.png'):
+    """Walk a directory tree and stat the images matching `pattern`.
+
+    :param str directory: Root of the tree.
+    :param str pattern: Pattern of the file names, see `fnmatch`.
+    :return: Dict `{directory: {name: [size, mtime_ns]}}` of the directories 
+     holding images; the directories are absolute paths.
+    """
+    found = {}
+    todo = [os.path.abspath(directory)]
+    while todo:
+        d = todo.pop()
+        files = {}
+        with os.scandir(d) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if not entry.name.startswith('.'):
+                        todo.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    st = entry.stat()
+                    files[entry.name] = [st.st_size, st.st_mtime_ns]
+        if files:
+            found[d] = files
+    return found
+
+def directory_title(root, directory, title):
+    """Title of the tiddler of a directory: `title` for the root and 
+    `title/sub/dir` for the directories below.
+    """
+    rel = os.path.relpath(directory, root)
+    return title if rel == os.curdir else title + '/' + rel.replace(os.sep, '/')
+
+def sync_directory(infile, directory, pattern='*.png', outfile=None, 
+    title=None, per_tiddler=None, description='', tags='', **options):
+    """Add a tiddler for each directory of images, and replace it when its 
+    images change.
+
+    The size and mtime of the images published, and the titles of the 
+    tiddlers of each directory, are kept in the manifest `wiki + '.fpsync'` 
+    next to the wiki written. Only the directories whose images were added, 
+    removed or changed since are published again, so a sync with nothing 
+    new costs a walk of the tree and does not write the wiki. The pages left 
+    over when a directory shrinks, and the tiddlers of the directories 
+    without images any more, are removed.
+
+    :param str infile: TiddlyWiki file.
+    :param str directory: Root of the tree of images.
+    :param str pattern: Pattern of the image file names, see `fnmatch`.
+    :param str outfile: Output file. When it is `None`, overwrites the input file.
+    :param str title: Title of the tiddler of the root. The tiddlers of the 
+     subdirectories are titled `title/sub/dir`. The default is the name of 
+     the root.
+    :param int per_tiddler: Maximum number of images in a tiddler (see 
+     `page_tiddlers()`).
+    :param str description: Text of the new tiddlers.
+    :param tags: Tags of the new tiddlers (see `addtiddler()`).
+    :param options: Other keyword arguments of `addtiddlers()`.
+    :return: Number of the tiddlers added or removed.
+    """
+    root = os.path.abspath(directory)
+    if title == None:
+        title = os.path.basename(root)
+    path = (infile if outfile == None else outfile) + '.fpsync'
+    try:
+        with open(path, encoding='utf-8') as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('version') != 2:    # older manifests: sync everything
+        manifest = dict(version=2, dirs={})
+    dirs = manifest['dirs']     # directory -> files and titles of the tiddlers
+    found = scan_images(root, pattern)
+    specs = []
+    synced = {}
+    for d in sorted(found, key=natural_key):
+        if d in dirs and dirs[d]['files'] == found[d]:
+            continue
+        dtitle = directory_title(root, d, title)
+        images = [os.path.join(d, n) for n in sorted(found[d], key=natural_key)]
+        pages = page_tiddlers(dtitle, images, per_tiddler, description, tags)
+        titles = [spec['title'] for spec in pages]
+        specs.extend(pages)
+        for t in dirs.get(d, {}).get('titles', []):
+            if not t in titles:
+                specs.append(dict(title=t, remove=True))
+        synced[d] = dict(files=found[d], titles=titles)
+    subdir = os.path.join(root, '')
+    gone = [d for d in dirs if not d in found 
+        and (d == root or d.startswith(subdir))]
+    for d in gone:
+        specs.extend(dict(title=t, remove=True) for t in dirs[d]['titles'])
+    if not specs:
+        return 0
+    for spec in specs:
+        spec['replace'] = True
+    added = addtiddlers(infile, specs, outfile, **options)
+    if added or not synced:     # the removed tiddlers may be gone already
+        dirs.update(synced)
+        for d in gone:
+            del dirs[d]
+        tmpfile = path + '.tmp'
+        with open(tmpfile, encoding='utf-8', mode='w') as fp:
+            json.dump(manifest, fp, separators=(',', ':'))
+        os.replace(tmpfile, path)
+    return added
+
+class DirectoryWatcher(object):
+    """Find the images created in a directory tree by polling.
+
+    The mtime of every directory is cached, and only the directories whose 
+    mtime changed are listed again, so a poll of a tree holding 100k images 
+    costs one `os.stat()` per directory. Files rewritten in place do not 
+    change the mtime of their directory and are not reported again.
+
+    The mtime has the coarse resolution of the kernel clock: a file created 
+    just after a listing, within the same tick, leaves the mtime unchanged. 
+    So a directory modified less than `racy` seconds before it was listed 
+    is listed again at every poll until that is no longer the case.
+    """
+    racy = 2.0
+
+    def __init__(self, directory, pattern='*.png'):
+        """Constructor. Scans the tree; the images already there are in 
+        `self.images` and are not reported by `poll()`.
+
+        :param str directory: Root of the tree.
+        :param str pattern: Pattern of the image file names, see `fnmatch`.
+        """
+        self.root = os.path.abspath(directory)
+        self.pattern = pattern
+        self.dirs = {}      # directory -> [mtime_ns, names, racy]
+        self.images = self.scan(self.root)
+
+    def scan(self, directory):
+        """List `directory` and its new subdirectories.
+
+        :return: List of the new images.
+        """
+        new = []
+        todo = [directory]
+        while todo:
+            d = todo.pop()
+            try:
+                listed = time.time_ns()
+                mtime = os.stat(d).st_mtime_ns
+                with os.scandir(d) as it:
+                    entries = list(it)
+            except FileNotFoundError:
+                self.dirs.pop(d, None)
+                continue
+            known = self.dirs.get(d, [None, set(), False])[1]
+            names = set()
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if entry.path not in self.dirs:
+                        todo.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, self.pattern):
+                    names.add(entry.name)
+                    if entry.name not in known:
+                        new.append(entry.path)
+            self.dirs[d] = [mtime, names, listed - mtime < self.racy * 1e9]
+        return new
+
+    def poll(self, full=False):
+        """Images created since the last poll.
+
+        :param boolean full: List every directory again, e.g. for the last 
+         poll.
+        :return: List of the paths.
+        """
+        new = []
+        for d in list(self.dirs):
+            try:
+                mtime = os.stat(d).st_mtime_ns
+            except FileNotFoundError:
+                del self.dirs[d]
+                continue
+            cached, names, racy = self.dirs[d]
+            if full or racy or mtime != cached:
+                new.extend(self.scan(d))
+        return new
+
+def watch_directory(infile, directory, pattern='*.png', outfile=None, 
+    group=None, title=None, interval=1.0, delay=2.0, per_tiddler=None, 
+    description='', tags='', stop=None, **options):
+    """Publish the images as they are created in a directory tree.
+
+    The tree is polled every `interval` seconds (see `DirectoryWatcher`). New 
+    images are collected until none arrived for `delay` seconds, then the 
+    tiddlers of the batch are created or replaced in one read/publish pass. 
+    Each tiddler shows every image of its group seen since the watch 
+    started, including those already there.
+
+    :param str infile: TiddlyWiki file.
+    :param str directory: Root of the tree of images.
+    :param str pattern: Pattern of the image file names, see `fnmatch`.
+    :param str outfile: Output file. When it is `None`, overwrites the input file.
+    :param str group: Regular expression grouping the images by file name. 
+     The title of the tiddler is its first group, e.g. `'(.*)_[0-9]+[.]png'` 
+     puts `temp_1.png` and `temp_2.png` in the tiddler `temp`. By default, 
+     the images are grouped by directory (see `sync_directory()`).
+    :param str title: Title of the tiddler of the root directory, when 
+     grouping by directory.
+    :param float interval: Seconds between the polls.
+    :param float delay: Seconds without new images before publishing.
+    :param int per_tiddler: Maximum number of images in a tiddler (see 
+     `page_tiddlers()`).
+    :param str description: Text of the new tiddlers.
+    :param tags: Tags of the new tiddlers (see `addtiddler()`).
+    :param stop: Set it to stop watching, after publishing the pending 
+     images. Ctrl-C does the same.
+    :type stop: threading.Event
+    :param options: Other keyword arguments of `addtiddlers()`.
+    """
+    if stop == None:
+        stop = threading.Event()
+    watcher = DirectoryWatcher(directory, pattern)
+    if title == None:
+        title = os.path.basename(watcher.root)
+    regex = re.compile(group) if group != None else None
+
+    def group_title(path):
+        if regex == None:
+            return directory_title(watcher.root, os.path.dirname(path), title)
+        name = os.path.basename(path)
+        m = regex.search(name)
+        if m == None:
+            return os.path.splitext(name)[0]
+        return m.group(1) if regex.groups else m.group(0)
+
+    groups = {}
+    for path in watcher.images:
+        groups.setdefault(group_title(path), set()).add(path)
+    pending = set()
+    last = 0.0
+    while True:
+        stopping = stop.is_set()
+        new = watcher.poll(full=stopping)
+        if new:
+            last = time.monotonic()
+        for path in new:
+            t = group_title(path)
+            groups.setdefault(t, set()).add(path)
+            pending.add(t)
+        if pending and (stopping or time.monotonic() - last >= delay):
+            specs = []
+            for t in sorted(pending, key=natural_key):
+                images = sorted(groups[t], key=natural_key)
+                if regex != None:   # the groups span directories
+                    images.sort(key=lambda p: natural_key(os.path.basename(p)))
+                specs.extend(page_tiddlers(t, images, per_tiddler, description, tags))
+            for spec in specs:
+                spec['replace'] = True
+            addtiddlers(infile, specs, outfile, **options)
+            pending.clear()
+        if stopping:
+            return
+        try:
+            stop.wait(interval)
+        except KeyboardInterrupt:
+            stop.set()
+
+def queue_tiddlers(infile, tiddlers, outfile=None, **options):
+    """Add tiddlers to a wiki shared by several processes.
+
+    The tiddler specs and the session options are dropped into the queue 
+    directory `infile + '.fpqueue'`, then the lock file `infile + '.lock'` 
+    is locked with `fcntl.flock()`. The process holding the lock applies 
+    every queued file, its own and those of the processes waiting for the 
+    lock, with one read/publish pass per set of options (see 
+    `apply_queue()`). A waiting process whose specs were applied meanwhile 
+    returns without reading the wiki. A queue file whose specs fail is moved 
+    to `infile + '.fpqueue/failed'`, and the process that queued it reports 
+    the error.
+
+    :param str infile: TiddlyWiki file. It is overwritten.
+    :param tiddlers: Tiddler specs, see `addtiddlers()`.
+    :type tiddlers: list of dict
+    :param str outfile: Must be `None`.
+    :param options: Keyword arguments of `PortfolioSession`, stored with the 
+     specs. `stats` is not stored; it records the passes of this process.
+    :return: Number of the tiddlers added by this process, including the ones 
+     queued by the others, or `None` when the specs of this process failed.
+    """
+    if fcntl == None:
+        print("Locking requires fcntl, which is not available on this platform.")
+        return None
+    if outfile != None:
+        print("Locking adds the tiddlers to `infile`; `outfile` cannot be used.")
+        return None
+    infile = os.path.abspath(infile)
+    stats = options.pop('stats', None)
+    if options.get('thumbnails') != None:
+        options['thumbnails'] = os.path.abspath(options['thumbnails'])
+    queued = []
+    for spec in tiddlers:
+        spec = dict(spec)
+        if spec.get('image') != None:   # relative to this process's directory
+            if type(spec['image']) == list:
+                spec['image'] = [os.path.abspath(im) for im in spec['image']]
+            else:
+                spec['image'] = os.path.abspath(spec['image'])
+        queued.append(spec)
+    queuedir = infile + '.fpqueue'
+    os.makedirs(queuedir, exist_ok=True)
+    name = '{:020d}-{}.json'.format(time.time_ns(), uuid.uuid4().hex)
+    with open(os.path.join(queuedir, name + '.tmp'), encoding='utf-8', mode='w') as fp:
+        json.dump(dict(options=options, tiddlers=queued), fp)
+    os.replace(os.path.join(queuedir, name + '.tmp'), os.path.join(queuedir, name))
+
+    with open(infile + '.lock', mode='a') as lockfile:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        try:
+            added = 0
+            if os.path.exists(os.path.join(queuedir, name)):
+                added = apply_queue(infile, stats)
+            failed = os.path.join(queuedir, 'failed', name)
+            if os.path.exists(failed):
+                with open(failed + '.error', encoding='utf-8') as fp:
+                    error = fp.read()
+                print("Warning: the queued tiddlers {} failed: {}".format(failed, error))
+                return None
+            return added    # 0 when applied by another process
+        finally:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+def apply_queue(infile, stats=None):
+    """Apply the queue files of `infile`, see `queue_tiddlers()`. The caller 
+    holds the lock.
+
+    The files are applied in the order they were queued, one session for 
+    the files with the same options. When the specs of a file raise an 
+    exception, the session is dropped without writing, the file is moved to 
+    the directory `failed` with the error in `<name>.error`, and the other 
+    files are applied again.
+
+    :param str infile: TiddlyWiki file.
+    :param Stats stats: Record the phases of the sessions.
+    :return: Number of the tiddlers added.
+    """
+    queuedir = infile + '.fpqueue'
+    names = sorted(n for n in os.listdir(queuedir) if n.endswith('.json'))
+    queue = []
+    for n in names:
+        with open(os.path.join(queuedir, n), encoding='utf-8') as fp:
+            queue.append((n, json.load(fp)))
+    added = 0
+    while queue:
+        options = queue[0][1]['options']
+        group = [(n, q) for n, q in queue if q['options'] == options]
+        current = None
+        try:
+            with PortfolioSession(infile, stats=stats, **options) as ps:
+                count = 0
+                for current, q in group:
+                    for spec in q['tiddlers']:
+                        count += ps.add(**spec)
+                current = None  # an error while publishing is not the specs'
+        except Exception as exc:
+            if current == None:
+                raise
+            os.makedirs(os.path.join(queuedir, 'failed'), exist_ok=True)
+            failed = os.path.join(queuedir, 'failed', current)
+            with open(failed + '.error', encoding='utf-8', mode='w') as fp:
+                fp.write('{}: {}'.format(type(exc).__name__, exc))
+            os.replace(os.path.join(queuedir, current), failed)
+            queue = [(n, q) for n, q in queue if n != current]
+            continue
+        for n, q in group:
+            os.remove(os.path.join(queuedir, n))
+        queue = [(n, q) for n, q in queue if q['options'] != options]
+        added += count
+    return added
+
+class PortfolioServer(object):
+    """Keep a TiddlyWiki in memory and add the tiddlers sent to a Unix domain 
+    socket.
+
+    Each request is one line of JSON, and one line of JSON is sent back::
+
+        {"op": "add", "title": "Run 1", "image": "/abs/run1.png", "tags": "sweep"}
+        {"op": "flush"}
+        {"op": "shutdown"}
+
+    The fields of `add` are the parameters of `addtiddler()`. The wiki is 
+    written `delay` seconds after the last `add`, on `flush` and on 
+    `shutdown`, so that many requests cost one `publish()`. The server owns 
+    the wiki while it runs: changes made to the file by others are 
+    overwritten.
+    """
+    def __init__(self, infile, address, delay=2.0, lazy=False, cache=False):
+        """Constructor
+
+        :param str infile: TiddlyWiki file. It is overwritten.
+        :param str address: Path of the Unix domain socket.
+        :param float delay: Seconds to wait for more requests before writing.
+        :param boolean lazy: Memory-map the wiki (see `addtiddler()`).
+        :param boolean cache: Use the sidecar index (see `addtiddler()`).
+        """
+        self.session = PortfolioSession(os.path.abspath(infile), lazy=lazy, cache=cache)
+        self.address = address
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.timer = None
+        self.server = None
+        self.stopping = False
+
+    def handle(self, request):
+        """Process one request.
+
+        :param dict request: Decoded request.
+        :return: Reply dict, `{"ok": true}` on success.
+        """
+        op = request.pop('op', 'add')
+        if op == 'add':
+            with self.lock:
+                ok = self.session.add(**request)
+                if self.timer != None:
+                    self.timer.cancel()
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            return dict(ok=ok)
+        elif op == 'flush':
+            self.flush()
+            return dict(ok=True)
+        elif op == 'shutdown':
+            self.flush()
+            self.stopping = True
+            return dict(ok=True)
+        return dict(ok=False, error='unknown op {!r}'.format(op))
+
+    def flush(self):
+        """Write the tiddlers added so far. """
+        with self.lock:
+            if self.timer != None:
+                self.timer.cancel()
+                self.timer = None
+            self.session.publish()
+
+    def serve_forever(self):
+        """Listen on `self.address` until a `shutdown` request. """
+        if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+            print("The server requires Unix domain sockets.")
             return None
-    else:
-        if outfile == None:
-            image = relative_path_to_image(infile, image)
-        else:
-            image = relative_path_to_image(outfile, image)
+        owner = self
 
-    if image != None:
-        ptxt = markdown_ptext(image, description)
-    else:
-        ptxt = description
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        reply = owner.handle(json.loads(line.decode('utf-8')))
+                    except Exception as e:
+                        reply = dict(ok=False, error=repr(e))
+                    self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+                    if owner.stopping:
+                        threading.Thread(target=owner.server.shutdown).start()
+                        break
 
-    tagold = tw.taglist
-    if type(tags) != list:
-        tags = tags.split(',')
-    if type(tags) == list:
-        tags = [tiddlytag(t.strip()) for t in tags]
-    else:
-        tags = [tiddlytag(tags)]
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self.server = socketserver.ThreadingUnixStreamServer(self.address, Handler)
+        self.server.daemon_threads = True
+        print("serving: ", self.session.infile, "at", self.address)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.address)
+            self.flush()
+            self.session.tw.close()
 
-    tw.new_tiddler(title, ptxt, tags, replace)
-    tw.tags()
-    tagnew = tw.taglist
-    if tagnew != tagold:
-        tw.taglist_tiddler()
+def send_request(address, request):
+    """Send one request to a `PortfolioServer`.
 
-    if outfile == None:
-        tempd = tempfile.gettempdir()
-        tmpfile = os.path.join(tempd, os.path.split(infile)[1] + '.tmp')
-    else:
-        tmpfile = outfile
-    tw.publish(tmpfile)
-    print("published: ", tmpfile)
-    if outfile == None:
-       shutil.move(tmpfile, infile) 
+    :param str address: Path of the Unix domain socket.
+    :param dict request: Request, see `PortfolioServer`.
+    :return: Reply dict.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as reply:
+            return json.loads(reply.readline().decode('utf-8'))
+
+def submit_tiddler(address, title, image=None, description='', tags='', 
+    replace=True):
+    """Add a tiddler through a `PortfolioServer`. The parameters are the same 
+    as `addtiddler()`. The image paths are sent as absolute paths.
+
+    :param str address: Path of the Unix domain socket.
+    :return: `True` when the server added the tiddler.
+    """
+    if image != None:
+        if type(image) == list:
+            image = [os.path.abspath(im) for im in image]
+        else:
+            image = os.path.abspath(image)
+    reply = send_request(address, dict(op='add', title=title, image=image, 
+        description=description, tags=tags, replace=replace))
+    return reply.get('ok')
 
 #%%
 """
@@ -384,11 +2771,168 @@ def addtiddler(infile, title, outfile=None, image=None, description='',
 """       
 
 #%%
+class Catalog(object):
+    """Mirror of the tiddlers of a wiki in a SQLite database, to query them 
+    by tag and date without parsing the HTML::
+
+        with Catalog('tw5md_figs.html') as cat:
+            cat.sync()
+            cat.query(tags=['tomato'], since='20240101', until='20240201')
+
+    The tables are `tiddlers` (title, created, modified), `tags`, 
+    `tiddler_tags` linking both, and `images`, the image paths of each 
+    tiddler as written in it, relative to the wiki.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS tiddlers (id INTEGER PRIMARY KEY, 
+            title TEXT UNIQUE NOT NULL, created TEXT, modified TEXT);
+        CREATE INDEX IF NOT EXISTS tiddlers_created ON tiddlers (created);
+        CREATE INDEX IF NOT EXISTS tiddlers_modified ON tiddlers (modified);
+        CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, 
+            name TEXT UNIQUE NOT NULL);
+        CREATE TABLE IF NOT EXISTS tiddler_tags (tiddler INTEGER NOT NULL, 
+            tag INTEGER NOT NULL, PRIMARY KEY (tiddler, tag)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS tiddler_tags_tag ON tiddler_tags (tag, tiddler);
+        CREATE TABLE IF NOT EXISTS images (tiddler INTEGER NOT NULL, 
+            position INTEGER NOT NULL, path TEXT NOT NULL, 
+            PRIMARY KEY (tiddler, position)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS images_path ON images (path);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """
+
+    def __init__(self, wiki, path=None):
+        """Constructor. Opens or creates the database.
+
+        :param str wiki: TiddlyWiki file.
+        :param str path: The database. Default `wiki + '.fpdb'`.
+        """
+        self.wiki = wiki
+        self.db = sqlite3.connect(wiki + '.fpdb' if path == None else path)
+        self.db.executescript(self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Close the database. """
+        self.db.close()
+
+    def sync(self, lazy=True, cache=False):
+        """Bring the database up to date with the wiki. Nothing is read when 
+        the wiki did not change since the last sync (see `index_key()`); 
+        otherwise only the tiddlers whose `modified` changed are decoded, and 
+        the tiddlers gone from the wiki are deleted.
+
+        :param boolean lazy: Memory-map the wiki (see `TiddlyWikiParse`).
+        :param boolean cache: Use the sidecar index of the wiki.
+        :return: Number of the tiddlers inserted, updated or deleted.
+        """
+        db = self.db
+        key = json.dumps(index_key(self.wiki))
+        if db.execute("SELECT value FROM meta WHERE key = 'wiki'").fetchone() == (key,):
+            return 0
+        tw = TiddlyWikiParse(self.wiki, lazy=lazy, cache=cache)
+        tw.read()
+        known = {title: (tid, modified) for tid, title, modified in 
+            db.execute("SELECT id, title, modified FROM tiddlers")}
+        tagids = {name: tid for tid, name in db.execute("SELECT id, name FROM tags")}
+        changed = 0
+        with db:
+            for td in tw.tiddlers:
+                old = known.pop(td.title, None)
+                if old != None and old[1] == td.modified:
+                    continue
+                if old == None:
+                    tid = db.execute("INSERT INTO tiddlers (title, created, modified) "
+                        "VALUES (?, ?, ?)", (td.title, td.created, td.modified)).lastrowid
+                else:
+                    tid = old[0]
+                    db.execute("UPDATE tiddlers SET created = ?, modified = ? "
+                        "WHERE id = ?", (td.created, td.modified, tid))
+                    db.execute("DELETE FROM tiddler_tags WHERE tiddler = ?", (tid,))
+                    db.execute("DELETE FROM images WHERE tiddler = ?", (tid,))
+                for tag in getattr(td, 'tags', None) or []:
+                    tag = tag.strip('[]')
+                    if tag not in tagids:
+                        tagids[tag] = db.execute("INSERT INTO tags (name) VALUES (?)", 
+                            (tag,)).lastrowid
+                    db.execute("INSERT OR IGNORE INTO tiddler_tags VALUES (?, ?)", 
+                        (tid, tagids[tag]))
+                if 'type="text/x-markdown"' in td.head():
+                    images = [html.unescape(full or plain) for full, plain in 
+                        regimage.findall(''.join(td.text))]
+                    db.executemany("INSERT INTO images VALUES (?, ?, ?)", 
+                        [(tid, i, im) for i, im in enumerate(images)])
+                changed += 1
+            for tid, modified in known.values():
+                db.execute("DELETE FROM tiddlers WHERE id = ?", (tid,))
+                db.execute("DELETE FROM tiddler_tags WHERE tiddler = ?", (tid,))
+                db.execute("DELETE FROM images WHERE tiddler = ?", (tid,))
+                changed += 1
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('wiki', ?)", (key,))
+        tw.close()
+        return changed
+
+    def query(self, tags=(), since=None, until=None, field='created'):
+        """Tiddlers having all of `tags`, in a date range.
+
+        :param tags: Tags, without the `[[ ]]`.
+        :type tags: list of str
+        :param str since: Earliest date, a prefix of `YYYYmmddHHMMSSfff`, 
+         e.g. `'20240101'`.
+        :param str until: End of the range, excluded, e.g. `'20240201'`.
+        :param str field: `'created'` or `'modified'`.
+        :return: List of `(title, [image paths])` sorted by `field`.
+        """
+        if field not in ('created', 'modified'):
+            raise ValueError("field must be 'created' or 'modified'")
+        sql = ["SELECT t.title, i.path FROM tiddlers AS t LEFT JOIN images AS i "
+            "ON i.tiddler = t.id WHERE 1"]
+        args = []
+        for tag in tags:
+            sql.append("AND t.id IN (SELECT tiddler FROM tiddler_tags WHERE tag = "
+                "(SELECT id FROM tags WHERE name = ?))")
+            args.append(tag)
+        if since != None:
+            sql.append("AND t.{} >= ?".format(field))
+            args.append(since)
+        if until != None:
+            sql.append("AND t.{} < ?".format(field))
+            args.append(until)
+        sql.append("ORDER BY t.{}, t.id, i.position".format(field))
+        result = []
+        for title, path in self.db.execute(' '.join(sql), args):
+            if not result or result[-1][0] != title:
+                result.append((title, []))
+            if path != None:
+                result[-1][1].append(path)
+        return result
+
+    def images_of(self, tid):
+        """Image paths of the tiddler of id `tid`. """
+        return [path for (path,) in self.db.execute("SELECT path FROM images "
+            "WHERE tiddler = ? ORDER BY position", (tid,))]
+
+    def images(self, title):
+        """Image paths of the tiddler `title`, relative to the wiki. """
+        row = self.db.execute("SELECT id FROM tiddlers WHERE title = ?", 
+            (title,)).fetchone()
+        return [] if row == None else self.images_of(row[0])
+
+    def titles(self, image):
+        """Titles of the tiddlers showing `image`, a path as in `images()`. """
+        return [title for (title,) in self.db.execute("SELECT DISTINCT title "
+            "FROM tiddlers JOIN images ON images.tiddler = tiddlers.id "
+            "WHERE images.path = ? ORDER BY title", (image,))]
+
 if __name__ == "__main__":
     # Parse commandline arguments if this module is run as a script.
     import optparse
-    import glob
-    parser = optparse.OptionParser()
+    parser = optparse.OptionParser(usage='%prog [serve | submit | sync DIR | watch DIR] [options]')
     parser.add_option('-i', 
                         action='store', 
                         dest='infile', 
@@ -415,6 +2959,145 @@ if __name__ == "__main__":
                         dest='tags', 
                         default='', 
                         help='Quoted space-delimited tags for this tiddler.  Ex: --tags "images temperature depth"')
+    parser.add_option('--no-replace', 
+                        action='store_false', 
+                        dest='replace', 
+                        default=True, 
+                        help='Keep an existing tiddler with the same title and add the new one as "TITLE-01".')
+    parser.add_option('--per-tiddler', 
+                        action='store', 
+                        type='int', 
+                        dest='per_tiddler', 
+                        help='Split the images into tiddlers "TITLE-01", "TITLE-02"... of at most N images, indexed by "TITLE".')
+    parser.add_option('--lazy', 
+                        action='store_true', 
+                        dest='lazy', 
+                        default=False, 
+                        help='Memory-map INPUT instead of reading the text of every tiddler, for very large wikis.')
+    parser.add_option('--cache', 
+                        action='store_true', 
+                        dest='cache', 
+                        default=False, 
+                        help='Keep the metadata of the tiddlers in INPUT.fpidx and load it from there while it matches INPUT. Implies --lazy.')
+    parser.add_option('--thumbnails', 
+                        action='store', 
+                        dest='thumbnails', 
+                        help='Directory for thumbnails that link to the images (requires Pillow).')
+    parser.add_option('--dedup', 
+                        action='store_true', 
+                        dest='dedup', 
+                        default=False, 
+                        help='Link byte-identical images to the first copy seen.')
+    parser.add_option('--embed', 
+                        action='store_true', 
+                        dest='embed', 
+                        default=False, 
+                        help='Store the images in the wiki instead of linking the files.')
+    parser.add_option('--recent', 
+                        action='store', 
+                        type='int', 
+                        dest='recent', 
+                        default=0, 
+                        help='Keep a "Recent figures" tiddler linking to the N tiddlers modified last.')
+    parser.add_option('--split-taglist', 
+                        action='store_true', 
+                        dest='split_taglist', 
+                        default=False, 
+                        help='Split "Tag List" into "Tag List/A", "Tag List/B"... by first letter.')
+    parser.add_option('--shard', 
+                        action='store', 
+                        type='choice', 
+                        choices=['tag', 'date', 'hash'], 
+                        dest='shard', 
+                        help='INPUT is an index; add to the shard INPUT-name.KEY.html chosen by the first tag, the month or a hash of the title.')
+    parser.add_option('--stats', 
+                        action='store', 
+                        dest='stats', 
+                        help='Print ("-") or append to STATS a JSON line with the time, bytes, tiddler counts and peak memory of each phase.')
+    parser.add_option('--profile', 
+                        action='store', 
+                        dest='profile', 
+                        help='Write a cProfile dump of the call to PROFILE.')
+    parser.add_option('--socket', 
+                        action='store', 
+                        dest='socket', 
+                        help='Path to the Unix domain socket of "serve" and "submit".')
+    parser.add_option('--delay', 
+                        action='store', 
+                        type='float', 
+                        dest='delay', 
+                        default=2.0, 
+                        help='serve, watch: seconds to wait for more tiddlers before writing INPUT. Default 2.')
+    parser.add_option('--interval', 
+                        action='store', 
+                        type='float', 
+                        dest='interval', 
+                        default=1.0, 
+                        help='watch: seconds between the scans of DIR. Default 1.')
+    parser.add_option('--group', 
+                        action='store', 
+                        dest='group', 
+                        help='watch: regular expression grouping the images by file name; the first group is the title. Default: one tiddler per directory.')
+    parser.add_option('--flush', 
+                        action='store_true', 
+                        dest='flush', 
+                        help='submit: ask the server to write the wiki now.')
+    parser.add_option('--shutdown', 
+                        action='store_true', 
+                        dest='shutdown', 
+                        help='submit: ask the server to write the wiki and stop.')
     (options, args) = parser.parse_args()
-    images = glob.glob(options.image)
+    command = args[0] if args else None
+    if options.shard and options.outfile:
+        parser.error('-o cannot be used with --shard.')
+    if command == 'serve':
+        # python figure_portfolio.py serve -i tw5md_figs.html --socket /tmp/fp.sock
+        PortfolioServer(options.infile, options.socket, options.delay, 
+            lazy=options.lazy, cache=options.cache).serve_forever()
+    elif command == 'submit':
+        # python figure_portfolio.py submit --socket /tmp/fp.sock --title T --image "*.png"
+        if options.title:
+            images = expand_images(options.image) if options.image else None
+            submit_tiddler(options.socket, options.title, images, 
+                options.description, options.tags, options.replace)
+        if options.flush:
+            send_request(options.socket, dict(op='flush'))
+        if options.shutdown:
+            send_request(options.socket, dict(op='shutdown'))
+    elif command == 'sync':
+        # python figure_portfolio.py sync runs -i tw5md_figs.html --image "*.png"
+        sync_directory(options.infile, args[1], options.image or '*.png', 
+            options.outfile, options.title, options.per_tiddler, 
+            options.description, options.tags, lazy=options.lazy, 
+            cache=options.cache, thumbnails=options.thumbnails, 
+            dedup=options.dedup, embed=options.embed, shard=options.shard, 
+            recent=options.recent, split_taglist=options.split_taglist, 
+            stats=options.stats, profile=options.profile)
+    elif command == 'watch':
+        # python figure_portfolio.py watch runs -i tw5md_figs.html --group "(.*)_\d+\.png"
+        watch_directory(options.infile, args[1], options.image or '*.png', 
+            options.outfile, options.group, options.title, options.interval, 
+            options.delay, options.per_tiddler, options.description, 
+            options.tags, lazy=options.lazy, cache=options.cache, 
+            thumbnails=options.thumbnails, dedup=options.dedup, 
+            embed=options.embed, shard=options.shard, 
+            recent=options.recent, split_taglist=options.split_taglist, 
+            stats=options.stats, profile=options.profile)
+    elif options.infile == None or options.title == None:
+        parser.error('-i and --title are required.')
+    elif options.image:
+        # python figure_portfolio.py -i tw5md_figs.html --title Temp --image "temp_*.png" --per-tiddler 50
+        addimages(options.infile, options.title, options.image, options.outfile, 
+            options.per_tiddler, options.description, options.tags, 
+            options.replace, lazy=options.lazy, cache=options.cache, 
+            thumbnails=options.thumbnails, dedup=options.dedup, 
+            embed=options.embed, shard=options.shard, 
+            recent=options.recent, split_taglist=options.split_taglist, 
+            stats=options.stats, profile=options.profile)
+    else:
+        addtiddler(options.infile, options.title, options.outfile, 
+            description=options.description, tags=options.tags, 
+            replace=options.replace, lazy=options.lazy, cache=options.cache, 
+            shard=options.shard, recent=options.recent, split_taglist=options.split_taglist, 
+            stats=options.stats, profile=options.profile)
 
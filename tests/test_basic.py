@@ -1,4 +1,18 @@
 import unittest
+import base64
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import multiprocessing
+import ntpath
+import threading
+import time
 
 """
 When I'm on ~/dev/figure_portfolio directry
@@ -8,6 +22,13 @@ When I'm on ~/dev/figure_portfolio directry
 
 from figure_portfolio import figure_portfolio
 
+def add_locked(wiki, worker, n):
+    """Worker of `test_queue_tiddlers`. """
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(n):
+            figure_portfolio.addtiddler(wiki, 'Worker {} run {}'.format(worker, i), 
+                description='run', tags='sweep', lock=True)
+
 class TestCore(unittest.TestCase):
 
     text = '<div created="201801" modified="201802" '
@@ -27,11 +48,17 @@ class TestCore(unittest.TestCase):
 
     def setUp(self):
         # procedures before every tests are started. This code block is executed every time
-        pass
+        self.workd = tempfile.mkdtemp()
 	
     def tearDown(self):
         # procedures after every tests are finished. This code block is executed every time
-        pass
+        shutil.rmtree(self.workd)
+
+    def mock_wiki(self, name='tw.html'):
+        """Copy the mock wiki to `name` in the work directory. """
+        wiki = os.path.join(self.workd, name)
+        shutil.copy(os.path.join('tests', 'tw5md_mock.html'), wiki)
+        return wiki
 
     def test_twread_mockfile(self):
         infile = open("tests\\tw5md_mock.html", encoding="utf-8")
@@ -112,6 +139,25 @@ class TestCore(unittest.TestCase):
         self.assertEqual(test_tags, tiddler.tags)
         self.assertEqual(test_created, tiddler.created)
 
+    def test_Tiddler_fast_parse(self):
+        for infile in [os.path.join('tests', 'tw5md_mock.html'), 
+            os.path.join('figure_portfolio', 'tw5md_figs.html')]:
+            tw = figure_portfolio.TiddlyWikiParse(infile)
+            tw.read()
+            for td in tw.tiddlers:
+                slow = figure_portfolio.Tiddler(td.text)
+                slow.parse(fast=False)
+                self.assertEqual(slow.title, td.title)
+                self.assertEqual(slow.created, td.created)
+                self.assertEqual(getattr(slow, 'tags', None), getattr(td, 'tags', None))
+
+        # the opening tag spans two lines
+        tiddler = figure_portfolio.Tiddler(['<div created="2018" tags="a" \n', 
+            'title="Q &amp; A">\n', '<pre>text</pre></div>\n'])
+        tiddler.parse()
+        self.assertEqual('Q & A', tiddler.title)
+        self.assertEqual(['a'], tiddler.tags)
+
     def test_tiddlytag(self):
         tags = [('python', 'python'), ('blue sky', '[[blue sky]]')]
         for rawtag, tiddly_tag in tags:
@@ -123,6 +169,46 @@ class TestCore(unittest.TestCase):
         self.assertEqual('![image](mytest.png){:width="1000"}\n', 
             figure_portfolio.markdownimage(img))
 
+    def test_markdownthumb(self):
+        self.assertEqual('[![image](t/ab-400.png)](mytest.png)\n', 
+            figure_portfolio.markdownthumb('t/ab-400.png', 'mytest.png'))
+        self.assertEqual('[![image](t1.png)](p1.png)\n[![image](t2.png)](p2.png)\nfigs', 
+            figure_portfolio.markdown_ptext(['p1.png', 'p2.png'], 'figs', 
+            ['t1.png', 't2.png']))
+
+    @unittest.skipIf(figure_portfolio.Image is None, 'requires Pillow')
+    def test_thumbnails(self):
+        images = [os.path.join('tests', 'p30.png'), os.path.join('tests', 'p32.png')]
+        shutil.copy(images[0], os.path.join(self.workd, 'copy.png'))
+        images.append(os.path.join(self.workd, 'copy.png'))
+        thumbdir = os.path.join(self.workd, 'thumbs')
+        thumbs = figure_portfolio.thumbnails(images, thumbdir, size=100)
+        self.assertEqual(thumbs[0], thumbs[2])
+        self.assertEqual(2, len(os.listdir(thumbdir)))
+        with figure_portfolio.Image.open(thumbs[1]) as im:
+            self.assertTrue(max(im.size) <= 100)
+        mtime = os.stat(thumbs[0]).st_mtime_ns
+        self.assertEqual(thumbs, figure_portfolio.thumbnails(images, thumbdir, size=100))
+        self.assertEqual(mtime, os.stat(thumbs[0]).st_mtime_ns)
+
+    def test_HashIndex(self):
+        images = [os.path.join('tests', 'p30.png'), os.path.join('tests', 'p32.png')]
+        shutil.copy(images[0], os.path.join(self.workd, 'copy.png'))
+        images.append(os.path.join(self.workd, 'copy.png'))
+        path = os.path.join(self.workd, 'wiki.html.fphash')
+        hashes = figure_portfolio.HashIndex(path)
+        linked = hashes.dedup(images)
+        self.assertEqual(os.path.abspath(images[0]), linked[2])
+        self.assertEqual(1, hashes.duplicates)
+        self.assertEqual(os.path.getsize(images[0]), hashes.saved)
+        hashes.save()
+        hashes = figure_portfolio.HashIndex(path)
+        self.assertEqual(3, len(hashes.files))
+        # a changed canonical copy passes the role to the next one
+        with open(images[2], 'ab') as fp:
+            fp.write(b'x')
+        self.assertEqual([os.path.abspath(images[2])], hashes.dedup(images[2:]))
+
     def test_tiddler_generate(self):
         # makes a tiddler block
         tidtype = 'text/x-markdown'
@@ -247,6 +333,202 @@ class TestCore(unittest.TestCase):
         for tl_1, tl_2 in zip(tw.trailerlines, tw2.trailerlines):
                 self.assertEqual(tl_1, tl_2)
 
+    def test_read_lazy(self):
+        infile = os.path.join('tests', 'tw5md_mock.html')
+        tw = figure_portfolio.TiddlyWikiParse(infile)
+        tw.read()
+        twl = figure_portfolio.TiddlyWikiParse(infile, lazy=True)
+        twl.read()
+        self.assertEqual(tw.headerlines, twl.headerlines)
+        self.assertEqual(tw.trailerlines, twl.trailerlines)
+        self.assertEqual([td.text for td in tw.tiddlers], [td.text for td in twl.tiddlers])
+        self.assertEqual([td.title for td in tw.tiddlers], [td.title for td in twl.tiddlers])
+        self.assertEqual(tw.taglist, twl.taglist)
+
+        outfile = os.path.join(self.workd, 'tw.html')
+        twl.new_tiddler('Blue Moon', 'Hello moon', ['yellow'], replace=True)
+        twl.publish(outfile)
+        twl.close()
+        twl.remap(outfile)
+        self.assertEqual('Blue Moon', twl.tiddlers[-1].title)
+        self.assertEqual('<pre>Hello moon\n', twl.tiddlers[-1].text[1])
+        self.assertEqual(tw.tiddlers[0].text, twl.tiddlers[0].text)
+        twl.close()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddlers(outfile, [dict(title='Run 1', 
+                description='first')], lazy=True)
+        tw2 = figure_portfolio.TiddlyWikiParse(outfile)
+        tw2.read()
+        self.assertEqual(['$:/config/markdown/dialect', 
+            'Generated tiddler markdown', 'Recently Added', 'Blue Moon', 
+            'Run 1'], [td.title for td in tw2.tiddlers])
+
+    def test_publish_mapped_outfile(self):
+        # the second publish() overwrites the outfile mapped by the first one
+        wiki = self.mock_wiki()
+        outfile = os.path.join(self.workd, 'out.html')
+        with contextlib.redirect_stdout(io.StringIO()):
+            with figure_portfolio.PortfolioSession(wiki, outfile, lazy=True) as ps:
+                ps.add('Run 1', description='first')
+                ps.publish()
+                ps.add('Run 2', description='second')
+        tw = figure_portfolio.TiddlyWikiParse(outfile)
+        tw.read()
+        self.assertEqual(['Recently Added', 'Run 1', 'Run 2'], 
+            [td.title for td in tw.tiddlers][2:])
+        self.assertIn('<pre>first\n', tw.tiddlers[3].text)
+        self.assertEqual(['out.html', 'tw.html'], sorted(os.listdir(self.workd)))
+
+    def test_append_tiddlers(self):
+        wiki = self.mock_wiki()
+        for lazy in (False, True):
+            tw = figure_portfolio.TiddlyWikiParse(wiki, lazy=lazy)
+            tw.read()
+            tw.new_tiddler('Run {}'.format(lazy), 'moon', ['blue'], replace=True)
+            expected = os.path.join(self.workd, 'expected.html')
+            tw.publish(expected)
+            self.assertTrue(tw.append_tiddlers(wiki))
+            tw.close()
+            with open(wiki, mode='rb') as f, open(expected, mode='rb') as g:
+                self.assertEqual(g.read(), f.read())
+            self.assertFalse(os.path.exists(wiki + '.fpjournal'))
+
+        # replacing a stored tiddler needs the full publish
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        tw.new_tiddler('Recently Added', 'moon', [], replace=True)
+        self.assertFalse(tw.append_tiddlers(wiki))
+
+        # a crash after the journal was written
+        with open(wiki, mode='rb') as f:
+            old = f.read()
+        trailer = ''.join(tw.trailerlines).encode('utf-8')
+        figure_portfolio.write_journal(wiki, len(old) - len(trailer), trailer).close()
+        with open(wiki, mode='r+b') as f:
+            f.seek(len(old) - len(trailer))
+            f.write(b'<div created="2018" title="partial">\n<pre>')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(figure_portfolio.recover_journal(wiki))
+        with open(wiki, mode='rb') as f:
+            self.assertEqual(old, f.read())
+        self.assertFalse(os.path.exists(wiki + '.fpjournal'))
+
+    def test_index_cache(self):
+        wiki = self.mock_wiki()
+        tw = figure_portfolio.TiddlyWikiParse(wiki, cache=True)
+        tw.read()
+        self.assertTrue(os.path.exists(wiki + '.fpidx'))
+
+        twc = figure_portfolio.TiddlyWikiParse(wiki, cache=True)
+        twc.open_mapping(wiki)
+        self.assertTrue(twc.load_index(wiki))
+        for td, tdc in zip(tw.tiddlers, twc.tiddlers):
+            self.assertEqual((td.title, td.created, td.modified, td.text), 
+                (tdc.title, tdc.created, tdc.modified, tdc.text))
+        self.assertEqual(tw.headerlines, twc.headerlines)
+        self.assertEqual(tw.trailerlines, twc.trailerlines)
+        self.assertEqual(['blue', '[[red dot]]'], twc.taglist)
+        twc.close()
+        tw.close()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddler(wiki, 'Run 1', description='first', 
+                tags='blue', cache=True)
+        twc = figure_portfolio.TiddlyWikiParse(wiki, cache=True)
+        twc.open_mapping(wiki)
+        self.assertTrue(twc.load_index(wiki))
+        self.assertEqual('Run 1', twc.tiddlers[-1].title)
+        self.assertEqual(['blue'], twc.tiddlers[-1].tags)
+        twc.close()
+
+        # edited by someone else
+        with open(wiki, mode='a', encoding='utf-8') as f:
+            f.write('\n')
+        twc = figure_portfolio.TiddlyWikiParse(wiki, cache=True)
+        twc.open_mapping(wiki)
+        self.assertFalse(twc.load_index(wiki))
+        twc.close()
+
+    @unittest.skipIf(figure_portfolio.fcntl is None, 'requires fcntl')
+    def test_queue_tiddlers(self):
+        wiki = self.mock_wiki()
+        workers = [multiprocessing.Process(target=add_locked, args=(wiki, w, 10)) 
+            for w in range(6)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        titles = set(td.title for td in tw.tiddlers)
+        for w in range(6):
+            for i in range(10):
+                self.assertIn('Worker {} run {}'.format(w, i), titles)
+        self.assertEqual(3 + 60 + 1, len(tw.tiddlers))
+        self.assertEqual([], os.listdir(wiki + '.fpqueue'))
+
+    @unittest.skipIf(figure_portfolio.fcntl is None, 'requires fcntl')
+    def test_queue_failure(self):
+        wiki = self.mock_wiki()
+        missing = os.path.join(self.workd, 'missing.png')
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(None, figure_portfolio.addtiddler(wiki, 'Bad', 
+                image=missing, dedup=True, lock=True))
+            self.assertIn('FileNotFoundError', out.getvalue())
+            # the bad file does not block the queue
+            self.assertEqual(1, figure_portfolio.addtiddler(wiki, 'Good', 
+                description='good', lock=True))
+        self.assertEqual(['failed'], os.listdir(wiki + '.fpqueue'))
+        self.assertEqual(2, len(os.listdir(os.path.join(wiki + '.fpqueue', 'failed'))))
+
+        # the specs are applied with the options of the process that queued them
+        queuedir = wiki + '.fpqueue'
+        image = os.path.join(self.workd, 'p30.png')
+        shutil.copy(os.path.join('tests', 'p30.png'), image)
+        with open(os.path.join(queuedir, '0-other.json'), encoding='utf-8', mode='w') as fp:
+            json.dump(dict(options=dict(embed=True), 
+                tiddlers=[dict(title='Embedded', image=image)]), fp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(2, figure_portfolio.addtiddler(wiki, 'Linked', image=image, 
+                lock=True))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertIsNotNone(tw.find_tiddler('p30.png')[0])
+        self.assertIn('(p30.png)', ''.join(tw.tiddlers[tw.find_tiddler('Linked')[0]].text))
+        self.assertEqual(None, tw.find_tiddler('Bad')[0])
+
+    @unittest.skipIf(not hasattr(figure_portfolio.socketserver, 
+        'ThreadingUnixStreamServer'), 'requires Unix domain sockets')
+    def test_PortfolioServer(self):
+        wiki = self.mock_wiki()
+        address = os.path.join(self.workd, 'fp.sock')
+        server = figure_portfolio.PortfolioServer(wiki, address, delay=60)
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            while not os.path.exists(address):
+                time.sleep(0.01)
+            for i in range(5):
+                self.assertTrue(figure_portfolio.submit_tiddler(address, 
+                    'Run {}'.format(i), description='run', tags='sweep'))
+            reply = figure_portfolio.send_request(address, dict(op='nop'))
+            self.assertFalse(reply['ok'])
+            self.assertEqual({'ok': True}, 
+                figure_portfolio.send_request(address, dict(op='flush')))
+            tw = figure_portfolio.TiddlyWikiParse(wiki)
+            tw.read()
+            self.assertEqual(['Run 0', 'Run 1', 'Run 2', 'Run 3', 'Run 4', 
+                'Tag List'], [td.title for td in tw.tiddlers[3:]])
+
+            figure_portfolio.submit_tiddler(address, 'Run 5', description='run')
+            figure_portfolio.send_request(address, dict(op='shutdown'))
+            thread.join()
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual('Run 5', tw.tiddlers[-1].title)
+        self.assertFalse(os.path.exists(address))
+
     def test_trim_path_to_image(self):
         outfile1, image1, p1 = "d1/tw.html", "d2/d3/pict.png", "..\\d2\\d3\\pict.png"
         outfile2, image2, p2 = "d1/tw.html", "d1/d3/pict.png", "d3\\pict.png"
@@ -255,12 +537,12 @@ class TestCore(unittest.TestCase):
         outfile5, image5, p5 = "tw.html", "d4/pict.png", "d4\\pict.png"
         outfile6, image6, p6 = "d1/d2/d3/tw.html", "pict.png", "..\\..\\..\\pict.png"
 
-        self.assertEqual(p1, figure_portfolio.trim_path_to_image(outfile1, image1))
-        self.assertEqual(p2, figure_portfolio.trim_path_to_image(outfile2, image2))
-        self.assertEqual(p3, figure_portfolio.trim_path_to_image(outfile3, image3))
-        self.assertEqual(p4, figure_portfolio.trim_path_to_image(outfile4, image4))
-        self.assertEqual(p5, figure_portfolio.trim_path_to_image(outfile5, image5))
-        self.assertEqual(p6, figure_portfolio.trim_path_to_image(outfile6, image6))
+        self.assertEqual(p1, figure_portfolio.trim_path_to_image(outfile1, image1, ntpath))
+        self.assertEqual(p2, figure_portfolio.trim_path_to_image(outfile2, image2, ntpath))
+        self.assertEqual(p3, figure_portfolio.trim_path_to_image(outfile3, image3, ntpath))
+        self.assertEqual(p4, figure_portfolio.trim_path_to_image(outfile4, image4, ntpath))
+        self.assertEqual(p5, figure_portfolio.trim_path_to_image(outfile5, image5, ntpath))
+        self.assertEqual(p6, figure_portfolio.trim_path_to_image(outfile6, image6, ntpath))
 
     def test_relative_path_to_image(self):
         outfile1, image1, p1 = "d1/tw.html", "d2/d3/pict.png", "..\\d2\\d3\\pict.png"
@@ -270,10 +552,512 @@ class TestCore(unittest.TestCase):
         image5, p5 = "d1/d2/pict.png", "..\\pict.png"
         outfile6, image6, p6 = "d1/d2/d3/tw.html", "d1/d2/d3/d4/pict.png", "d4\\pict.png"
         self.assertEqual([p1, p2, p3], 
-            figure_portfolio.relative_path_to_image(outfile1, [image1, image2, image3]))
+            figure_portfolio.relative_path_to_image(outfile1, [image1, image2, image3], ntpath))
         self.assertEqual([p4, p5],
-            figure_portfolio.relative_path_to_image(outfile4, [image4, image5]))
-        self.assertEqual(p6, figure_portfolio.trim_path_to_image(outfile6, image6))
+            figure_portfolio.relative_path_to_image(outfile4, [image4, image5], ntpath))
+        self.assertEqual(p6, figure_portfolio.trim_path_to_image(outfile6, image6, ntpath))
+
+    def test_PathResolver(self):
+        paths = figure_portfolio.PathResolver('/home/u/site/tw.html', posixpath)
+        self.assertEqual(['../figs/a.png', 'b.png', 'sub/c.png', '../../../d.png'], 
+            paths(['/home/u/figs/a.png', '/home/u/site/b.png', 
+                '/home/u/site/./sub/c.png', '/d.png']))
+        self.assertEqual('../../x/y.png', paths('/home/x/y.png'))
+        self.assertEqual(5, len(paths.dirs))
+        paths = figure_portfolio.PathResolver('C:\\Users\\u\\tw.html', ntpath)
+        self.assertEqual(['figs\\a.png', '..\\Pics\\b.png', 'D:\\c.png'], 
+            paths(['c:/users/u/figs/a.png', 'C:\\Users\\Pics\\b.png', 'D:\\c.png']))
+        # relative and absolute paths are resolved with os.path
+        self.assertEqual(os.path.join('..', 'pict.png'), 
+            figure_portfolio.trim_path_to_image(os.path.join('d1', 'tw.html'), 
+                os.path.abspath('pict.png')))
+
+    def test_title_index(self):
+        tw = figure_portfolio.TiddlyWikiParse(os.path.join('tests', 'tw5md_mock.html'))
+        tw.read()
+        self.assertEqual((0, '20180206151146040'), 
+            tw.find_tiddler('$:/config/markdown/dialect'))
+        self.assertEqual((None, None), tw.find_tiddler('Blue Moon'))
+
+        # replacing the first tiddler must not append a new one
+        tw.new_tiddler('$:/config/markdown/dialect', 'maruku', '', replace=True)
+        self.assertEqual(3, len(tw.tiddlers))
+        self.assertEqual('20180206151146040', tw.tiddlers[0].created)
+
+        for i in range(3):
+            tw.new_tiddler('Recently Added', 'moon', [], replace=False)
+        self.assertEqual((4, tw.tiddlers[4].created), tw.find_tiddler('Recently Added-02'))
+        self.assertEqual('Recently Added-04', tw.free_title('Recently Added'))
+
+        removed = tw.remove_tiddler('Recently Added-02')
+        self.assertEqual('Recently Added-02', removed.title)
+        self.assertEqual(None, tw.remove_tiddler('Recently Added-02'))
+        self.assertEqual(4, tw.find_tiddler('Recently Added-03')[0])
+        self.assertEqual('Recently Added-02', tw.free_title('Recently Added'))
+
+    def test_tag_registry(self):
+        tw = figure_portfolio.TiddlyWikiParse(os.path.join('tests', 'tw5md_mock.html'))
+        tw.read()
+        self.assertEqual({'blue': 1, '[[red dot]]': 1}, tw.tagcount)
+        version = tw.tagversion
+
+        tw.new_tiddler('Blue Moon', 'moon', ['blue', 'yellow'], replace=True)
+        self.assertEqual({'blue': 2, '[[red dot]]': 1, 'yellow': 1}, tw.tagcount)
+        self.assertEqual(['blue', '[[red dot]]'], tw.taglist)
+        self.assertNotEqual(version, tw.tagversion)
+
+        version = tw.tagversion
+        tw.new_tiddler('Blue Moon', 'moon', ['yellow'], replace=True)
+        self.assertEqual({'blue': 1, '[[red dot]]': 1, 'yellow': 1}, tw.tagcount)
+        self.assertEqual(version, tw.tagversion)
+
+        tw.remove_tiddler('Generated tiddler markdown')
+        self.assertEqual({'yellow': 1}, tw.tagcount)
+        self.assertNotEqual(version, tw.tagversion)
+        tw.tags()
+        self.assertEqual(['yellow'], tw.taglist)
+
+    def test_addtiddlers(self):
+        wiki = self.mock_wiki()
+        specs = [dict(title='Run 1', description='first', tags='sweep'),
+            dict(title='Run 2', description='second', tags='sweep, step two'),
+            dict(title='Run 1', description='again', replace=False),
+            dict(title='Empty')]
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            added = figure_portfolio.addtiddlers(wiki, specs)
+        self.assertEqual(3, added)
+        self.assertEqual(1, out.getvalue().count('published:') 
+            + out.getvalue().count('appended:'))
+
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        titles = [td.title for td in tw.tiddlers]
+        self.assertEqual(['$:/config/markdown/dialect', 
+            'Generated tiddler markdown', 'Recently Added', 
+            'Run 1', 'Run 2', 'Run 1-01', 'Tag List'], titles)
+        self.assertEqual(['blue', '[[red dot]]', 'sweep', '[[step two]]'], 
+            tw.taglist)
+
+    def test_addimages(self):
+        names = ['temp_10.png', 'temp_2.png', 'Temp_1.png', 'temp_1b.png', 'temp_3.png']
+        self.assertEqual(['Temp_1.png', 'temp_1b.png', 'temp_2.png', 'temp_3.png', 
+            'temp_10.png'], sorted(names, key=figure_portfolio.natural_key))
+        wiki = self.mock_wiki()
+        for n in names:
+            shutil.copy(os.path.join('tests', 'p30.png'), os.path.join(self.workd, n))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            added = figure_portfolio.addimages(wiki, 'Temp', 
+                os.path.join(self.workd, '*emp_*.png'), per_tiddler=2, 
+                description='sweep', tags='temp')
+        self.assertEqual(4, added)
+        self.assertEqual(1, out.getvalue().count('published:') 
+            + out.getvalue().count('appended:'))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(['Temp-01', 'Temp-02', 'Temp-03', 'Temp'], 
+            [td.title for td in tw.tiddlers][3:7])
+        self.assertIn('(temp_3.png)', '\n'.join(tw.tiddlers[4].text))
+        self.assertIn('* [Temp-02](#Temp-02) temp_2.png ... temp_3.png\n', 
+            '\n'.join(tw.tiddlers[6].text))
+
+        # the new index and its pages must not take the titles of the old ones
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(3, figure_portfolio.addimages(wiki, 'Temp', 
+                os.path.join(self.workd, 'temp_*.png'), per_tiddler=2, replace=False))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(['Temp-04-01', 'Temp-04-02', 'Temp-04'], 
+            [td.title for td in tw.tiddlers][8:11])
+        self.assertIn('* [Temp-04-01](#Temp-04-01)', '\n'.join(tw.tiddlers[10].text))
+        self.assertIn('* [Temp-02](#Temp-02)', 
+            '\n'.join(tw.tiddlers[tw.find_tiddler('Temp')[0]].text))
+
+    def test_sync_directory(self):
+        wiki = self.mock_wiki()
+        runs = os.path.join(self.workd, 'runs')
+        os.makedirs(os.path.join(runs, 'r2'))
+        os.makedirs(os.path.join(runs, 'r10'))
+        for d in ['', 'r2', 'r10']:
+            shutil.copy(os.path.join('tests', 'p30.png'), os.path.join(runs, d, 'a.png'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(3, figure_portfolio.sync_directory(wiki, runs))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(['runs', 'runs/r2', 'runs/r10'], 
+            [td.title for td in tw.tiddlers][3:6])
+
+        mtime = os.stat(wiki).st_mtime_ns
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(0, figure_portfolio.sync_directory(wiki, runs))
+        self.assertEqual('', out.getvalue())
+        self.assertEqual(mtime, os.stat(wiki).st_mtime_ns)
+
+        shutil.copy(os.path.join('tests', 'p32.png'), os.path.join(runs, 'r10', 'b.png'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(1, figure_portfolio.sync_directory(wiki, runs))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(6, len(tw.tiddlers))
+        self.assertIn('b.png', '\n'.join(tw.tiddlers[tw.find_tiddler('runs/r10')[0]].text))
+
+    def test_sync_directory_stale(self):
+        wiki = self.mock_wiki()
+        runs = os.path.join(self.workd, 'runs')
+        os.makedirs(os.path.join(runs, 'r2'))
+        for n in ['a.png', 'b.png']:
+            shutil.copy(os.path.join('tests', 'p30.png'), os.path.join(runs, n))
+        shutil.copy(os.path.join('tests', 'p32.png'), os.path.join(runs, 'r2', 'a.png'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(4, figure_portfolio.sync_directory(wiki, runs,
+                per_tiddler=1))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(['runs-01', 'runs-02', 'runs', 'runs/r2'],
+            [td.title for td in tw.tiddlers][3:7])
+
+        os.remove(os.path.join(runs, 'b.png'))
+        shutil.rmtree(os.path.join(runs, 'r2'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(4, figure_portfolio.sync_directory(wiki, runs,
+                per_tiddler=1))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(['runs'], [td.title for td in tw.tiddlers][3:])
+        self.assertNotIn('b.png', '\n'.join(tw.tiddlers[3].text))
+        with open(wiki + '.fpsync', encoding='utf-8') as fp:
+            self.assertEqual([os.path.abspath(runs)], list(json.load(fp)['dirs']))
+
+    def test_watch_directory(self):
+        wiki = self.mock_wiki()
+        runs = os.path.join(self.workd, 'runs')
+        os.makedirs(runs)
+        shutil.copy(os.path.join('tests', 'p30.png'), os.path.join(runs, 'temp_1.png'))
+        stop = threading.Event()
+        watcher = threading.Thread(target=figure_portfolio.watch_directory, 
+            args=(wiki, runs), kwargs=dict(group=r'(.*)_\d+\.png', 
+            interval=0.02, delay=0.2, stop=stop))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            watcher.start()
+            time.sleep(0.1)
+            os.makedirs(os.path.join(runs, 'r2'))
+            for name in ['temp_2.png', 'r2/temp_10.png', 'r2/depth_1.png']:
+                shutil.copy(os.path.join('tests', 'p30.png'), os.path.join(runs, name))
+                time.sleep(0.05)
+            time.sleep(0.5)
+            stop.set()
+            watcher.join()
+        self.assertEqual(1, out.getvalue().count('published:') 
+            + out.getvalue().count('appended:'))
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        self.assertEqual(['depth', 'temp'], [td.title for td in tw.tiddlers][3:5])
+        text = '\n'.join(tw.tiddlers[4].text)
+        self.assertTrue(text.index('temp_1.png') < text.index('temp_2.png') 
+            < text.index('temp_10.png'))
+
+    def test_DirectoryWatcher(self):
+        runs = os.path.join(self.workd, 'runs')
+        os.makedirs(runs)
+        watcher = figure_portfolio.DirectoryWatcher(runs)
+
+        def add_same_tick(name):
+            # a file created in the tick of the listing leaves the mtime as it was
+            st = os.stat(runs)
+            shutil.copy(os.path.join('tests', 'p30.png'), os.path.join(runs, name))
+            os.utime(runs, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        # just modified: listed again although the mtime did not change
+        add_same_tick('temp_1.png')
+        self.assertEqual([os.path.join(runs, 'temp_1.png')], watcher.poll())
+        self.assertEqual([], watcher.poll())
+
+        # modified long ago: found by the full poll
+        os.utime(runs, ns=(0, 0))
+        watcher.poll()
+        self.assertFalse(watcher.dirs[runs][2])
+        add_same_tick('temp_2.png')
+        self.assertEqual([], watcher.poll())
+        self.assertEqual([os.path.join(runs, 'temp_2.png')], watcher.poll(full=True))
+
+    def test_embed(self):
+        wiki = self.mock_wiki()
+        os.makedirs(os.path.join(self.workd, 'figs'))
+        image = os.path.join(self.workd, 'figs', 'p30.png')
+        shutil.copy(os.path.join('tests', 'p30.png'), image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddler(wiki, 'Embedded', image=image, embed=True)
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        index, created = tw.find_tiddler('figs/p30.png')
+        td = tw.tiddlers[index]
+        self.assertIn('type="image/png"', td.head())
+        data = ''.join(td.text[1:]).replace('<pre>', '').replace('</pre></div>', '')
+        with open(image, 'rb') as fp:
+            self.assertEqual(fp.read(), base64.b64decode(data.strip()))
+        td = tw.tiddlers[tw.find_tiddler('Embedded')[0]]
+        self.assertIn('![image](figs/p30.png)', ''.join(td.text))
+
+        # chunks encoded in parallel are concatenated in order
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            td = figure_portfolio.ImageTiddler('<div title="x">\n', image, pool, 
+                chunksize=3 * 100)
+            raw = td.raw()
+        with open(image, 'rb') as fp:
+            self.assertEqual(raw, b'<div title="x">\n<pre>' 
+                + base64.b64encode(fp.read()) + b'</pre></div>\n')
+
+        # the next images are encoded while the wiki is written
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            for name in ['p30.png', 'p32.png']:
+                tw.new_image_tiddler(name, os.path.join('tests', name), pool)
+            blocks = tw.blocks(tw.tiddlers)
+            next(blocks)
+            self.assertTrue(all(td.prefetched is not None for td in tw.tiddlers[-2:]))
+            outfile = os.path.join(self.workd, 'out.html')
+            tw.publish(outfile)
+        tw = figure_portfolio.TiddlyWikiParse(outfile)
+        tw.read()
+        for name in ['p30.png', 'p32.png']:
+            td = tw.tiddlers[tw.find_tiddler(name)[0]]
+            data = ''.join(td.text[1:]).replace('<pre>', '').replace('</pre></div>', '')
+            with open(os.path.join('tests', name), 'rb') as fp:
+                self.assertEqual(fp.read(), base64.b64decode(data.strip()))
+
+    def test_embed_republish(self):
+        wiki = self.mock_wiki()
+        os.makedirs(os.path.join(self.workd, 'img'))
+        image = os.path.join(self.workd, 'img', 'b.png')
+        shutil.copy(os.path.join('tests', 'p30.png'), image)
+        with open(image, 'rb') as fp:
+            data = base64.b64encode(fp.read()).decode('ascii')
+        with contextlib.redirect_stdout(io.StringIO()):
+            with figure_portfolio.PortfolioSession(wiki, embed=True) as ps:
+                ps.add('Embedded', image=image)
+                ps.publish()
+                modified = ps.tw.tiddlers[ps.tw.find_tiddler('img/b.png')[0]].modified
+                # the wiki is rewritten for the new tag, without the sources
+                shutil.copy(os.path.join('tests', 'p32.png'), image)
+                ps.add('Changed', description='other', tags='zebra')
+                ps.publish()
+                os.remove(image)
+                ps.add('Removed', description='other', tags='yak')
+                ps.publish()
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        td = tw.tiddlers[tw.find_tiddler('img/b.png')[0]]
+        self.assertEqual(modified, td.modified)
+        self.assertIn(data, ''.join(td.text))
+        self.assertIsNotNone(tw.find_tiddler('Removed')[0])
+
+    def test_shard_tiddlers(self):
+        wiki = self.mock_wiki('figs.html')
+        specs = [dict(title='Run 1', description='first', tags='tomato, red'),
+            dict(title='Run 2', description='second', tags=['potato']),
+            dict(title='Run 3', description='third', tags='tomato')]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(3, figure_portfolio.addtiddlers(wiki, specs, shard='tag'))
+        self.assertEqual(['figs.html', 'figs.potato.html', 'figs.tomato.html'], 
+            sorted(n for n in os.listdir(self.workd) if n.endswith('.html')))
+        tw = figure_portfolio.TiddlyWikiParse(os.path.join(self.workd, 'figs.tomato.html'))
+        tw.read()
+        self.assertEqual(['$:/config/markdown/dialect', 'Run 1', 'Run 3', 'Tag List'], 
+            [td.title for td in tw.tiddlers])
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        td = tw.tiddlers[tw.find_tiddler('Shards')[0]]
+        self.assertIn('* [potato](figs.potato.html)', ''.join(td.text))
+
+        # only the receiving shard is written
+        mtime = os.stat(wiki).st_mtime_ns
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddler(wiki, 'Run 4', description='fourth', 
+                tags='potato', shard='tag')
+        self.assertEqual(mtime, os.stat(wiki).st_mtime_ns)
+        self.assertEqual(figure_portfolio.shard_key(dict(title='Run 4'), 'hash'), 
+            figure_portfolio.shard_key(dict(title='Run 4'), 'hash'))
+        with self.assertRaises(ValueError):
+            figure_portfolio.shard_key(dict(title='Run 4'), 'size')
+
+        # the tiddlers go to the shards, not to an output file
+        outfile = os.path.join(self.workd, 'out.html')
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(None, figure_portfolio.addtiddler(wiki, 'Run 5', outfile, 
+                description='fifth', shard='tag'))
+            self.assertEqual(None, figure_portfolio.addimages(wiki, 'Run 6', 
+                os.path.join('tests', 'p30.png'), outfile, shard='date'))
+        self.assertEqual(2, out.getvalue().count('`outfile` cannot be used'))
+        self.assertFalse(os.path.exists(outfile))
+
+    def test_Catalog(self):
+        wiki = self.mock_wiki()
+        a, b, c, d = [os.path.join(self.workd, n) for n in ['a.png', 'b.png', 'c.png', 'd.png']]
+        specs = [dict(title='Run 1', image=a, tags='sweep, blue sky'),
+            dict(title='Run 2', image=[b, c], tags='sweep'),
+            dict(title='Notes', description='no image')]
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddlers(wiki, specs)
+        with figure_portfolio.Catalog(wiki) as cat:
+            self.assertEqual(7, cat.sync())
+            self.assertEqual(0, cat.sync())
+            self.assertEqual([('Run 1', ['a.png']), ('Run 2', ['b.png', 'c.png'])], 
+                cat.query(tags=['sweep']))
+            self.assertEqual(['Run 1'], [t for t, im in cat.query(tags=['sweep', 'blue sky'])])
+            self.assertEqual([], cat.query(tags=['sweep'], until='2018'))
+            self.assertEqual(['Run 2'], cat.titles('c.png'))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddler(wiki, 'Run 2', image=d, tags='other')
+        with figure_portfolio.Catalog(wiki) as cat:
+            self.assertEqual(2, cat.sync())     # Run 2 and Tag List
+            self.assertEqual(['Run 1'], [t for t, im in cat.query(tags=['sweep'])])
+            self.assertEqual(['d.png'], cat.images('Run 2'))
+
+    def test_query(self):
+        tw = figure_portfolio.TiddlyWikiParse(os.path.join('tests', 'tw5md_mock.html'))
+        tw.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tw.new_tiddler('Run 1', 'first', ['sweep', '[[blue sky]]'], True)
+            self.assertEqual([], tw.query(tags=['nothing']))
+            tw.new_tiddler('Run 2', 'second', ['sweep'], True)
+            tw.new_tiddler('Notes', 'notes', ['blue'], True)
+        titles = lambda tiddlers: [td.title for td in tiddlers]
+        self.assertEqual(['Run 1', 'Run 2'], titles(tw.query(tags=['sweep'])))
+        self.assertEqual(['Run 1'], titles(tw.query(tags=['sweep', 'blue sky'])))
+        self.assertEqual(['Run 2'], titles(tw.query(tags=['sweep'], not_tags=['blue sky'])))
+        self.assertEqual(['Run 1', 'Notes'], 
+            titles(tw.query(any_tags=['blue', 'blue sky'], created=('2019', None))))
+        self.assertEqual(['Run 1', 'Run 2'], titles(tw.query(title='Run ')))
+        self.assertEqual(['Run 2'], titles(tw.query(title=re.compile(r'\d$'), 
+            not_tags=['blue sky'])))
+        self.assertEqual([], tw.query(tags=['sweep'], modified=(None, '2018')))
+
+        # the indexes follow the replaced tiddlers
+        with contextlib.redirect_stdout(io.StringIO()):
+            tw.new_tiddler('Run 1', 'again', ['other'], True)
+        self.assertEqual(['Run 2'], titles(tw.query(tags=['sweep'])))
+        self.assertEqual(['Run 1'], titles(tw.query(tags=['other'], title='Run')))
+        tw.remove_tiddler('Run 2')
+        self.assertEqual([], tw.query(tags=['sweep']))
+
+    def test_recent(self):
+        self.assertEqual(20180300000000000, figure_portfolio.stamp_value('201803'))
+        self.assertEqual(None, figure_portfolio.stamp_value('2018-03'))
+        wiki = self.mock_wiki()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with figure_portfolio.PortfolioSession(wiki, recent=2) as ps:
+                ps.add('Run 1', description='first', tags='sweep')
+                ps.add('Run 2', description='second', tags='sweep')
+                ps.add('Notes', description='notes')
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        batch = [td for td in tw.tiddlers if td.title in ('Run 1', 'Run 2', 'Notes', 
+            'Tag List', 'Recent figures')]
+        self.assertEqual(1, len(set(td.modified for td in batch)))
+        self.assertEqual(['Recent figures', 'Tag List', 'Notes'], 
+            [td.title for td in tw.latest(3)])
+        self.assertEqual(5, len(tw.modified_since(batch[0].modified)))
+        self.assertEqual(5, len(tw.modified_since(int(batch[0].modified))))
+        self.assertEqual([], tw.modified_since(int(batch[0].modified) + 1))
+        text = ''.join(tw.tiddlers[tw.find_tiddler('Recent figures')[0]].text)
+        self.assertIn('* [Notes](#Notes)', text)
+        self.assertIn('* [Run 2](#Run%202)', text)
+        self.assertNotIn('Run 1', text)
+
+    def test_split_taglist(self):
+        tw = figure_portfolio.TiddlyWikiParse(os.path.join('tests', 'tw5md_mock.html'))
+        tw.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tw.new_tiddler('Run 1', 'first', ['apple', '[[apple pie]]', '3d'], True)
+        tw.tags()
+        tw.taglist_tiddler(split=True)
+        titles = [td.title for td in tw.tiddlers]
+        self.assertEqual(['Tag List/#', 'Tag List/A', 'Tag List/B', 'Tag List/R', 'Tag List'], 
+            titles[-5:])
+        text = ''.join(tw.tiddlers[tw.find_tiddler('Tag List/A')[0]].text)
+        self.assertIn('!!! apple pie\n&lt;&lt;list-links &quot;[tag[apple pie]]&quot;', text)
+        self.assertIn('* [[Tag List/R]]\n', ''.join(tw.tiddlers[-1].text))
+
+        # only the letters with new tags are generated again
+        tagb = tw.tiddlers[tw.find_tiddler('Tag List/B')[0]]
+        taglist = tw.tiddlers[-1]
+        with contextlib.redirect_stdout(io.StringIO()):
+            tw.new_tiddler('Run 2', 'second', ['avocado'], True)
+        tw.tags()
+        tw.taglist_tiddler(split=True)
+        self.assertIs(tagb, tw.tiddlers[tw.find_tiddler('Tag List/B')[0]])
+        self.assertIs(taglist, tw.tiddlers[tw.find_tiddler('Tag List')[0]])
+        self.assertIn('avocado', ''.join(tw.tiddlers[tw.find_tiddler('Tag List/A')[0]].text))
+
+    def test_split_taglist_stored(self):
+        wiki = self.mock_wiki()
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddler(wiki, 'Run 1', description='first',
+                tags='apple, banana', split_taglist=True)
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        stamps = {td.title: td.modified for td in tw.tiddlers
+            if td.title.startswith('Tag List')}
+        time.sleep(0.01)
+        # a new wiki object: the unchanged pages are kept as they are stored
+        with contextlib.redirect_stdout(io.StringIO()):
+            figure_portfolio.addtiddler(wiki, 'Run 2', description='second',
+                tags='avocado', split_taglist=True)
+        tw = figure_portfolio.TiddlyWikiParse(wiki)
+        tw.read()
+        changed = [td.title for td in tw.tiddlers if td.title in stamps
+            and td.modified != stamps[td.title]]
+        self.assertEqual(['Tag List/A'], changed)
+        self.assertIn('avocado', ''.join(tw.tiddlers[tw.find_tiddler('Tag List/A')[0]].text))
+
+    def test_stats(self):
+        wiki = self.mock_wiki()
+        stats = figure_portfolio.Stats()
+        profile = os.path.join(self.workd, 'add.prof')
+        with contextlib.redirect_stdout(io.StringIO()):
+            # replaces a stored tiddler, so the wiki is rewritten
+            figure_portfolio.addtiddler(wiki, 'Recently Added', description='first', 
+                tags='sweep', stats=stats, profile=profile)
+        record = stats.as_dict()
+        for phase in ['read', 'read_header', 'read_tiddler', 'tags', 
+            'new_tiddler', 'taglist_tiddler', 'publish', 'move']:
+            self.assertIn(phase, record['phases'])
+        self.assertEqual(1, record['phases']['new_tiddler']['calls'])
+        self.assertEqual(os.path.getsize(wiki), record['counters']['bytes_written'])
+        self.assertEqual(record['counters']['tiddlers_read'] + 1, 
+            record['counters']['tiddlers_written'])     # Tag List
+        self.assertEqual(1, record['counters']['tiddlers_added'])
+        self.assertTrue(os.path.getsize(profile) > 0)
+        # the peak traced within each phase, up to the peak of the call
+        peaks = [p['peak_memory'] for p in record['phases'].values()]
+        self.assertTrue(0 < min(peaks) < max(peaks) <= record['peak_memory'])
+        self.assertTrue(record['phases']['read_header']['peak_memory'] 
+            <= record['phases']['read']['peak_memory'])
+        self.assertFalse(figure_portfolio.tracemalloc.is_tracing())
+
+        # a JSON line per call, from the environment
+        lines = os.path.join(self.workd, 'stats.jsonl')
+        os.environ['FIGURE_PORTFOLIO_STATS'] = lines
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                figure_portfolio.addtiddler(wiki, 'Run 2', description='second', lazy=True)
+                figure_portfolio.addtiddler(wiki, 'Run 3', description='third', 
+                    stats=False)
+            os.environ['FIGURE_PORTFOLIO_STATS'] = '0'
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                figure_portfolio.addtiddler(wiki, 'Run 4', description='fourth')
+            self.assertNotIn('"phases"', out.getvalue())
+            self.assertFalse(os.path.exists('0'))
+        finally:
+            del os.environ['FIGURE_PORTFOLIO_STATS']
+        with open(lines, encoding='utf-8') as fp:
+            records = [json.loads(l) for l in fp]
+        self.assertEqual(1, len(records))
+        self.assertEqual('addtiddler', records[0]['call'])
+        self.assertEqual(wiki, records[0]['infile'])
+        self.assertIn('append_tiddlers', records[0]['phases'])
+        self.assertTrue(records[0]['counters']['bytes_read'] > 0)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file